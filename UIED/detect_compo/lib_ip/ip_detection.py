@@ -396,6 +396,59 @@ def compo_block_recognition(binary, compos, block_side_length=0.15):
                 compo.category = 'Block'
 
 
+def floodfill_regions(binary, min_obj_area, step_h=5, step_v=2):
+    """
+    Flood-fills the white area of each seed on the stride grid that is not filled yet
+    (the original sampling; each fill copies and diffs the full-size mask)
+    :return: regions of at least min_obj_area pixels as arrays of (row_index, column_index), in seed order
+    """
+    mask = np.zeros((binary.shape[0] + 2, binary.shape[1] + 2), dtype=np.uint8)
+    row, column = binary.shape[0], binary.shape[1]
+    for i in range(0, row, step_h):
+        for j in range(i % 2, column, step_v):
+            if binary[i, j] == 255 and mask[i, j] == 0:
+                # get connected area
+                # region = util.boundary_bfs_connected_area(binary, i, j, mask)
+
+                mask_copy = mask.copy()
+                ff = cv2.floodFill(binary, mask, (j, i), None, 0, 0, cv2.FLOODFILL_MASK_ONLY)
+                if ff[0] < min_obj_area: continue
+                mask_copy = mask - mask_copy
+                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))
+                yield region[:, ::-1]
+
+
+def labeled_regions(binary, min_obj_area, step_h=5, step_v=2):
+    """
+    Same regions as floodfill_regions from one connected-components pass, with areas from the
+    stats and pixels taken from the label image inside each bounding box.
+    The seed rules of the flood fill are kept: a seed starts a fill if it is white and its area is
+    not filled yet, but the mask is read one pixel up-left of the seed (the mask has a 1-pixel
+    border) and, once the first fill has set the mask border, seeds in row or column 0 never start one.
+    :return: regions of at least min_obj_area pixels as arrays of (row_index, column_index), in seed order
+    """
+    n, labels, stats, _ = cv2.connectedComponentsWithStats((binary == 255).view(np.uint8), connectivity=4)
+    filled = np.zeros(n, dtype=bool)  # filled[0] (not white) stays False
+    started = False
+    row, column = binary.shape[0], binary.shape[1]
+    for i in range(0, row, step_h):
+        cols = np.arange(i % 2, column, step_v)
+        hit = labels[i, cols]
+        cols, hit = cols[hit > 0], hit[hit > 0]
+        up_left = labels[i - 1, cols - 1] if i > 0 else hit
+        for j, label, mask_label in zip(cols.tolist(), hit.tolist(), up_left.tolist()):
+            if filled[label]:
+                continue
+            if (started if i == 0 or j == 0 else filled[mask_label]):
+                continue
+            filled[label] = started = True
+            if stats[label, cv2.CC_STAT_AREA] < min_obj_area:
+                continue
+            x, y, w, h = stats[label, :4]
+            rs, cs = np.nonzero(labels[y:y + h, x:x + w] == label)
+            yield np.column_stack((rs + y, cs + x))
+
+
 # take the binary image as input
 # calculate the connected regions -> get the bounding boundaries of them -> check if those regions are rectangles
 # return all boundaries and boundaries of rectangles
@@ -404,7 +457,7 @@ def component_detection(binary, min_obj_area,
                         min_rec_evenness=C.THRESHOLD_REC_MIN_EVENNESS,
                         max_dent_ratio=C.THRESHOLD_REC_MAX_DENT_RATIO,
                         step_h = 5, step_v = 2,
-                        rec_detect=False, show=False, test=False):
+                        rec_detect=False, show=False, test=False, method='labels'):
     """
     :param binary: Binary image from pre-processing
     :param min_obj_area: If not pass then ignore the small object
@@ -412,56 +465,45 @@ def component_detection(binary, min_obj_area,
     :param line_thickness: If not pass then ignore the slim object
     :param min_rec_evenness: If not pass then this object cannot be rectangular
     :param max_dent_ratio: If not pass then this object cannot be rectangular
+    :param method: 'labels' labels the binary map once (connectedComponentsWithStats);
+                   'floodfill' flood-fills from each seed. Both find the same components.
     :return: boundary: [top, bottom, left, right]
                         -> up, bottom: list of (column_index, min/max row border)
                         -> left, right: list of (row_index, min/max column border) detect range of each row
     """
-    mask = np.zeros((binary.shape[0] + 2, binary.shape[1] + 2), dtype=np.uint8)
     compos_all = []
     compos_rec = []
     compos_nonrec = []
-    row, column = binary.shape[0], binary.shape[1]
-    for i in range(0, row, step_h):
-        for j in range(i % 2, column, step_v):
-            if binary[i, j] == 255 and mask[i, j] == 0:
-                # get connected area
-                # region = util.boundary_bfs_connected_area(binary, i, j, mask)
-
-                mask_copy = mask.copy()
-                ff = cv2.floodFill(binary, mask, (j, i), None, 0, 0, cv2.FLOODFILL_MASK_ONLY)
-                if ff[0] < min_obj_area: continue
-                mask_copy = mask - mask_copy
-                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))
-                region = [(p[1], p[0]) for p in region]
-
-                # filter out some compos
-                component = Component(region, binary.shape)
-                # calculate the boundary of the connected area
-                # ignore small area
-                if component.width <= 3 or component.height <= 3:
-                    continue
-                # check if it is line by checking the length of edges
-                # if component.compo_is_line(line_thickness):
-                #     continue
+    regions = labeled_regions if method == 'labels' else floodfill_regions
+    for region in regions(binary, min_obj_area, step_h, step_v):
+        # filter out some compos
+        component = Component(region, binary.shape)
+        # calculate the boundary of the connected area
+        # ignore small area
+        if component.width <= 3 or component.height <= 3:
+            continue
+        # check if it is line by checking the length of edges
+        # if component.compo_is_line(line_thickness):
+        #     continue
 
-                if test:
-                    print('Area:%d' % (len(region)))
-                    draw.draw_boundary([component], binary.shape, show=True)
+        if test:
+            print('Area:%d' % (len(region)))
+            draw.draw_boundary([component], binary.shape, show=True)
 
-                compos_all.append(component)
+        compos_all.append(component)
 
-                if rec_detect:
-                    # rectangle check
-                    if component.compo_is_rectangle(min_rec_evenness, max_dent_ratio):
-                        component.rect_ = True
-                        compos_rec.append(component)
-                    else:
-                        component.rect_ = False
-                        compos_nonrec.append(component)
+        if rec_detect:
+            # rectangle check
+            if component.compo_is_rectangle(min_rec_evenness, max_dent_ratio):
+                component.rect_ = True
+                compos_rec.append(component)
+            else:
+                component.rect_ = False
+                compos_nonrec.append(component)
 
-                if show:
-                    print('Area:%d' % (len(region)))
-                    draw.draw_boundary(compos_all, binary.shape, show=True)
+        if show:
+            print('Area:%d' % (len(region)))
+            draw.draw_boundary(compos_all, binary.shape, show=True)
 
     # draw.draw_boundary(compos_all, binary.shape, show=True)
     if rec_detect:
@@ -499,8 +541,7 @@ def nested_components_detection(grey, org, grad_thresh,
                 # ignore small regions
                 if ff[0] < 500: continue
                 mask_copy = mask - mask_copy
-                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))
-                region = [(p[1], p[0]) for p in region]
+                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))[:, ::-1]
 
                 compo = Component(region, grey.shape)
                 # draw.draw_region(region, broad_all)
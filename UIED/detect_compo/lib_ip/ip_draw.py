@@ -99,12 +99,13 @@ def draw_boundary(components, shape, show=False):
     """
     board = np.zeros(shape[:2], dtype=np.uint8)  # binary board
     for component in components:
+        top, bottom, left, right = component.boundary
         # up and bottom: (column_index, min/max row border)
-        for point in component.boundary[0] + component.boundary[1]:
-            board[point[1], point[0]] = 255
+        for border in (top, bottom):
+            board[border[:, 1], border[:, 0]] = 255
         # left, right: (row_index, min/max column border)
-        for point in component.boundary[2] + component.boundary[3]:
-            board[point[0], point[1]] = 255
+        for border in (left, right):
+            board[border[:, 0], border[:, 1]] = 255
     if show:
         cv2.imshow('rec', board)
         cv2.waitKey(0)
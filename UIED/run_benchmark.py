@@ -0,0 +1,186 @@
+"""
+Times the element detection hot paths on the bundled input images and checks that each
+optimized path gives the same result as the original one.
+
+python run_benchmark.py --check labeling
+"""
+import argparse
+import glob
+import time
+from os.path import join as pjoin
+
+import numpy as np
+
+import detect_compo.lib_ip.ip_preprocessing as pre
+import detect_compo.lib_ip.ip_detection as det
+from detect_compo.lib_ip.Component import Component
+from config.CONFIG_UIED import Config
+from run_single import resize_height_by_longest_edge
+C = Config()
+
+KEY_PARAMS = {'min-grad': 10, 'min-ele-area': 50}  # as in run_single.py
+
+
+def best_time(fn, *args, repeat=3):
+    """Returns (best wall time in seconds, result of the last call)."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def load_binary(img_path, resize_length):
+    """Binary map as ip_region_proposal.compo_detection builds it before component_detection."""
+    resize_height = resize_height_by_longest_edge(img_path, resize_length) if resize_length else None
+    org, grey = pre.read_img(img_path, resize_height)
+    binary = pre.binarization(org, grad_min=KEY_PARAMS['min-grad'])
+    det.rm_line(binary)
+    return binary
+
+
+def check_labeling(binary, args):
+    def detect(method):
+        compos = det.component_detection(binary, min_obj_area=KEY_PARAMS['min-ele-area'], method=method)
+        return [(c.put_bbox(), c.region.tolist()) for c in compos]
+
+    t_old, reference = best_time(detect, 'floodfill', repeat=args.repeat)
+    t_new, result = best_time(detect, 'labels', repeat=args.repeat)
+    assert result == reference, "labeled components differ from the flood-filled ones"
+    return t_old, t_new, f"{len(result)} compos"
+
+
+def reference_boundary(region):
+    """Component.compo_get_boundary before it used NumPy: dicts updated per pixel, then sorted."""
+    border_up, border_bottom, border_left, border_right = {}, {}, {}, {}
+    for point in region:
+        if point[1] not in border_up or border_up[point[1]] > point[0]:
+            border_up[point[1]] = point[0]
+        if point[1] not in border_bottom or border_bottom[point[1]] < point[0]:
+            border_bottom[point[1]] = point[0]
+        if point[0] not in border_left or border_left[point[0]] > point[1]:
+            border_left[point[0]] = point[1]
+        if point[0] not in border_right or border_right[point[0]] < point[1]:
+            border_right[point[0]] = point[1]
+    boundary = [border_up, border_bottom, border_left, border_right]
+    for i in range(len(boundary)):
+        boundary[i] = [[k, boundary[i][k]] for k in boundary[i].keys()]
+        boundary[i] = sorted(boundary[i], key=lambda x: x[0])
+    return boundary
+
+
+def check_boundary(binary, args):
+    regions = list(det.labeled_regions(binary, KEY_PARAMS['min-ele-area']))
+    region_lists = [r.tolist() for r in regions]
+    t_old, reference = best_time(lambda: [reference_boundary(r) for r in region_lists], repeat=args.repeat)
+    t_new, result = best_time(lambda: [Component(r, binary.shape).boundary for r in regions], repeat=args.repeat)
+    assert [[b.tolist() for b in boundary] for boundary in result] == reference, "boundary arrays differ"
+    return t_old, t_new, f"{len(regions)} regions, {sum(len(r) for r in regions)} pixels"
+
+
+def reference_is_rectangle(compo, min_rec_evenness, max_dent_ratio):
+    """Component.compo_is_rectangle before it used NumPy: running counters per border pixel."""
+    dent_direction = [1, -1, 1, -1]
+    flat = 0
+    parameter = 0
+    for n, border in enumerate(compo.boundary):
+        parameter += len(border)
+        pit = 0
+        depth = 0
+        if n <= 1:
+            adj_side = max(len(compo.boundary[2]), len(compo.boundary[3]))
+        else:
+            adj_side = max(len(compo.boundary[0]), len(compo.boundary[1]))
+        abnm = 0
+        extents = border[:, 1].tolist()
+        for i in range(int(3 + len(border) * 0.02), len(border) - 1):
+            difference = extents[i] - extents[i + 1]
+            depth += difference
+            if i / len(border) < 0.08 and (dent_direction[n] * difference) / adj_side > 0.5:
+                depth = 0
+            if abs(depth) / adj_side > 0.3:
+                abnm += 1
+                if abnm / len(border) > 0.1:
+                    return False
+                continue
+            else:
+                abnm = 0
+            if dent_direction[n] * depth < 0 and abs(depth) / adj_side > 0.15:
+                pit += 1
+                continue
+            if abs(depth) < 1 + adj_side * 0.015:
+                flat += 1
+        if pit / len(border) > max_dent_ratio:
+            return False
+    if compo.height / compo.image_shape[0] > 0.3:
+        min_rec_evenness = 0.85
+    return (flat / parameter) >= min_rec_evenness
+
+
+def reference_is_line(compo, min_line_thickness):
+    """Component.compo_is_line before it used NumPy: one iteration per column and row."""
+    top, bottom, left, right = (border[:, 1].tolist() for border in compo.boundary)
+    slim = 0
+    for i in range(compo.width):
+        if abs(bottom[i] - top[i]) <= min_line_thickness:
+            slim += 1
+    if slim / len(compo.boundary[0]) > 0.93:
+        return True
+    slim = 0
+    for i in range(compo.height):
+        if abs(left[i] - right[i]) <= min_line_thickness:
+            slim += 1
+    return slim / len(compo.boundary[2]) > 0.93
+
+
+def check_shape(binary, args):
+    # element regions and the background regions between them, as in nested_components_detection
+    regions = list(det.labeled_regions(binary, KEY_PARAMS['min-ele-area']))
+    regions += list(det.labeled_regions(255 - binary, KEY_PARAMS['min-ele-area']))
+    compos = [Component(r, binary.shape) for r in regions]
+
+    def decide(is_rectangle, is_line):
+        return [(is_rectangle(c, C.THRESHOLD_REC_MIN_EVENNESS, C.THRESHOLD_REC_MAX_DENT_RATIO),
+                 is_line(c, C.THRESHOLD_LINE_THICKNESS)) for c in compos]
+
+    t_old, reference = best_time(decide, reference_is_rectangle, reference_is_line, repeat=args.repeat)
+    t_new, result = best_time(decide, Component.compo_is_rectangle, Component.compo_is_line, repeat=args.repeat)
+    assert result == reference, "rectangle / line decisions differ"
+    counts = np.array(result).sum(axis=0)
+    return t_old, t_new, f"{len(compos)} compos, {counts[0]} rectangles, {counts[1]} lines"
+
+
+CHECKS = {'labeling': ('ip_detection.py / component_detection', check_labeling),
+          'boundary': ('Component.py / compo_get_boundary', check_boundary),
+          'shape': ('Component.py / compo_is_rectangle, compo_is_line', check_shape)}
+
+
+def main():
+    args = get_args()
+    images = sorted(glob.glob(pjoin(args.input_dir, '*.jpg')) + glob.glob(pjoin(args.input_dir, '*.png')))
+    for name in args.check or CHECKS:
+        func, check = CHECKS[name]
+        total_old = total_new = 0
+        for img_path in images:
+            binary = load_binary(img_path, args.resize_length)
+            t_old, t_new, info = check(binary, args)
+            total_old += t_old
+            total_new += t_new
+            print(f"{name} {img_path} {binary.shape[1]}x{binary.shape[0]}: {t_old:.3f}s -> {t_new:.3f}s ({info})")
+        print(f"{func} : {len(images)} images : {total_old:.2f}s -> {total_new:.2f}s\n")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmarks element detection against the original implementations.")
+    parser.add_argument('--check', action='append', choices=sorted(CHECKS),
+                        help="Hot path to check and time (repeatable); all by default.")
+    parser.add_argument('--input_dir', default=pjoin('data', 'input'), help="Directory of input screenshots.")
+    parser.add_argument('--resize_length', type=int, default=800,
+                        help="Longest edge the images are resized to, as in run_single.py; 0 keeps the full size.")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed repetitions per image (best is reported).")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
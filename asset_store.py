@@ -0,0 +1,142 @@
+"""
+Content-addressed store of encoded crops shared by all runs.
+An asset is keyed on a hash of its pixels and encoding parameters, so identical crops of
+different placeholders or runs are encoded and stored once. index.json records, per asset,
+how many placeholders of each run reference it; releasing a run drops its references and
+`gc` deletes the assets no run references anymore.
+
+python asset_store.py --release <run_id> --gc
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+ASSET_DIR = Path(__file__).parent.resolve() / 'data' / 'assets'
+LOCK_TIMEOUT = 30      # Seconds to wait for another process holding the index lock
+LOCK_STALE_AFTER = 120 # Seconds after which a left-over lock file is considered stale
+
+
+def pixel_digest(image):
+    """Hash of an image array's shape, dtype and pixels."""
+    h = hashlib.sha256()
+    h.update(f"{image.shape}|{image.dtype}|".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+class AssetStore:
+    def __init__(self, root=ASSET_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.json"
+        self._lock_path = self.root / ".index.lock"
+
+    @staticmethod
+    def key(digest, encode_params):
+        """Asset key for a pixel digest encoded with the given parameters."""
+        return hashlib.sha256(f"{digest}|{encode_params}".encode()).hexdigest()
+
+    def path(self, key, extension):
+        return self.root / f"{key}{extension}"
+
+    def has(self, key, extension):
+        return self.path(key, extension).exists()
+
+    def put(self, key, extension, data):
+        """Stores encoded bytes under their key unless already present; returns the path."""
+        path = self.path(key, extension)
+        if not path.exists():
+            # write-then-rename so concurrent runs never read a partial asset
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        return path
+
+    # ---------- reference counting ----------
+    @contextlib.contextmanager
+    def _locked_index(self):
+        """Yields the index for modification and saves it, holding a cross-process lock file."""
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(self._lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                with contextlib.suppress(OSError):
+                    if time.time() - self._lock_path.stat().st_mtime > LOCK_STALE_AFTER:
+                        self._lock_path.unlink()
+                        continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Asset index is locked: {self._lock_path}")
+                time.sleep(0.05)
+        try:
+            index = json.loads(self.index_path.read_text()) if self.index_path.exists() else {}
+            yield index
+            tmp_path = self.index_path.with_name(f"index.json.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(index, indent=2, sort_keys=True))
+            os.replace(tmp_path, self.index_path)
+        finally:
+            os.close(fd)
+            self._lock_path.unlink()
+
+    def assign(self, run_id, refs):
+        """
+        Replaces the references of `run_id` with `refs` {key: (filename, bytes, count)}.
+        Re-running a run therefore never inflates its counts.
+        """
+        with self._locked_index() as index:
+            self._drop_run(index, run_id)
+            for key, (filename, size, count) in refs.items():
+                entry = index.setdefault(key, {"file": filename, "bytes": size, "runs": {}})
+                entry["runs"][run_id] = count
+
+    def release(self, run_id):
+        """Drops all references of a run; returns the number of assets it referenced."""
+        with self._locked_index() as index:
+            return self._drop_run(index, run_id)
+
+    @staticmethod
+    def _drop_run(index, run_id):
+        released = 0
+        for entry in index.values():
+            if entry["runs"].pop(run_id, None) is not None:
+                released += 1
+        return released
+
+    def gc(self):
+        """Deletes assets that no run references; returns (assets deleted, bytes freed)."""
+        deleted = freed = 0
+        with self._locked_index() as index:
+            for key in [k for k, entry in index.items() if not entry["runs"]]:
+                path = self.root / index.pop(key)["file"]
+                with contextlib.suppress(FileNotFoundError):
+                    freed += path.stat().st_size
+                    path.unlink()
+                    deleted += 1
+        return deleted, freed
+
+
+def main():
+    args = get_args()
+    store = AssetStore()
+    for run_id in args.release or []:
+        print(f"Released {store.release(run_id)} asset reference(s) of run {run_id}.")
+    if args.gc:
+        deleted, freed = store.gc()
+        print(f"Deleted {deleted} unreferenced asset(s), freed {freed / 1024:.1f} KB.")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Manages the shared content-addressed crop store.")
+    parser.add_argument('--release', action='append', metavar='RUN_ID',
+                        help="Drop the asset references of a run (repeatable).")
+    parser.add_argument('--gc', action='store_true', help="Delete assets that no run references.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Micro-benchmarks for the pipeline's hot paths.
+Each suite checks the optimized implementation against the reference one before timing both.
+
+python benchmarks.py --suite ciou
+"""
+import argparse
+import time
+import numpy as np
+import mapping
+from layout_document import LayoutDocument, PLACEHOLDER_CLASS, stream_replace_placeholders
+
+
+def best_time(fn, *args, repeat=5):
+    """Returns (best wall time in seconds, result of the last call)."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def random_boxes(rng, n, width=2400, height=1400, max_side=300):
+    xy = rng.uniform(0, 1, (n, 2)) * [width, height]
+    wh = rng.uniform(10, max_side, (n, 2))
+    return np.hstack([xy, wh])
+
+
+def bench_ciou(args):
+    rng = np.random.default_rng(args.seed)
+    for n, m in ((10, 50), (50, 200), (100, 500)):
+        a = random_boxes(rng, n)
+        # half of the candidates are jittered copies, so overlapping pairs are covered too
+        b = np.vstack([random_boxes(rng, m - m // 2), a[rng.integers(0, n, m // 2)] + rng.normal(0, 8, (m // 2, 4))])
+        b[:, 2:] = np.abs(b[:, 2:])
+
+        t_loop, reference = best_time(lambda: np.array([[mapping.ciou(p, q) for q in b] for p in a]), repeat=args.repeat)
+        t_matrix, result = best_time(mapping.ciou_matrix, a, b, repeat=args.repeat)
+        max_diff = np.abs(reference - result).max()
+        print(f"ciou {n}x{m}: loop {t_loop * 1000:.1f} ms, ciou_matrix {t_matrix * 1000:.3f} ms "
+              f"({t_loop / t_matrix:.0f}x), max abs diff {max_diff:.1e}")
+        assert max_diff < 1e-4, "ciou_matrix differs from ciou"
+
+
+def bench_uied_index(args):
+    rng = np.random.default_rng(args.seed)
+    for n_boxes, n_regions in ((200, 8), (2000, 40), (10000, 120)):
+        boxes = random_boxes(rng, n_boxes)
+        regions = random_boxes(rng, n_regions) * [1, 1, 2, 2]
+        placeholders = random_boxes(rng, n_regions * 5)
+
+        def scan():
+            # previous approach: per region, the center of every box is recomputed and tested
+            per_region = [[i for i, b in enumerate(boxes)
+                           if rx <= mapping.center(b)[0] <= rx + rw and ry <= mapping.center(b)[1] <= ry + rh]
+                          for rx, ry, rw, rh in regions]
+            centers = boxes[:, :2] + boxes[:, 2:] / 2
+            nearest = mapping.cdist(placeholders[:, :2] + placeholders[:, 2:] / 2, centers).argmin(axis=1)
+            return per_region, nearest
+
+        def indexed():
+            index = mapping.GridIndex(boxes[:, :2] + boxes[:, 2:] / 2)
+            per_region = [list(index.query_rect(*r)) for r in regions]
+            return per_region, index.nearest(placeholders[:, :2] + placeholders[:, 2:] / 2)
+
+        t_scan, reference = best_time(scan, repeat=args.repeat)
+        t_index, result = best_time(indexed, repeat=args.repeat)
+        assert reference[0] == result[0] and (reference[1] == result[1]).all(), "GridIndex differs from the scan"
+        print(f"uied_index {n_boxes} boxes / {n_regions} regions: scan {t_scan * 1000:.1f} ms, "
+              f"GridIndex {t_index * 1000:.2f} ms ({t_scan / t_index:.0f}x)")
+
+
+def bench_assignment(args):
+    rng = np.random.default_rng(args.seed)
+    for n_ph, n_uied in ((10, 50), (50, 200), (300, 1500), (800, 4000)):
+        placeholders = random_boxes(rng, n_ph, width=4000, height=8000, max_side=150)
+        # every placeholder has a jittered detection, plus unrelated detections
+        uied = np.vstack([placeholders + rng.normal(0, 6, placeholders.shape),
+                          random_boxes(rng, n_uied - n_ph, width=4000, height=8000, max_side=150)])
+        uied[:, 2:] = np.abs(uied[:, 2:])
+
+        def dense():
+            cost = -mapping.ciou_matrix(placeholders, uied)
+            rows, cols = mapping.linear_sum_assignment(cost)
+            keep = -cost[rows, cols] >= mapping.CIOU_STRICT
+            return float(-cost[rows, cols][keep].sum())
+
+        def gated(exact_max_cells=mapping.EXACT_MAX_CELLS, dense_max_cells=mapping.DENSE_MAX_CELLS):
+            matches, info = mapping.gated_assignment(placeholders, uied, dense_max_cells=dense_max_cells,
+                                                     exact_max_cells=exact_max_cells)
+            return sum(m[2] for m in matches), info
+
+        t_dense, dense_score = best_time(dense, repeat=args.repeat)
+        t_gated, (gated_score, info) = best_time(gated, repeat=args.repeat)
+        t_greedy, (greedy_score, _) = best_time(gated, 0, 0, repeat=args.repeat)
+        print(f"assignment {n_ph}x{n_uied}: dense {t_dense * 1000:.1f} ms (score {dense_score:.2f}), "
+              f"gated {info['mode']} {t_gated * 1000:.1f} ms (score {gated_score:.2f}, {info['components']} components), "
+              f"greedy {t_greedy * 1000:.1f} ms (score {greedy_score:.2f})")
+
+
+def generated_layout(rng, n_regions, pretty=False):
+    """A layout document with the structure html_generator writes: region boxes filled with generated code."""
+    boxes = "".join(f'<div class="box" id="{i}" style="left: 0.0%; top: {i / n_regions * 100:.1f}%; '
+                    f'width: 100.0%; height: {100 / n_regions:.1f}%;"></div>' for i in range(n_regions))
+    doc = LayoutDocument(f'<!DOCTYPE html><html><head><meta charset="utf-8"/><style>.{PLACEHOLDER_CLASS} '
+                         f'{{min-height: 1px}} /* <div class="{PLACEHOLDER_CLASS}"> */</style></head>'
+                         f'<body><div id="root">{boxes}</div></body></html>')
+    for i in range(n_regions):
+        cards = "".join(
+            f'<div class="flex gap-4 p-2"><div class="{PLACEHOLDER_CLASS} w-16 h-16 rounded"></div>'
+            f'<div class="space-y-1"><h3 class="font-bold">Item {i}-{j} &amp; more</h3>'
+            f'<p class="text-sm text-gray-600">Caption &lt;{j}&gt; with <a href="?a=1&amp;b=2">a link</a></p></div>'
+            + (f'<div class="{PLACEHOLDER_CLASS} h-32"><div class="{PLACEHOLDER_CLASS} h-8"></div></div>' if j % 4 == 0 else "")
+            + '<img class="w-4" src="icon.svg"/></div>'
+            for j in range(int(rng.integers(2, 8))))
+        doc.fill_region(i, f'<div class="p-4 bg-white">{cards}</div>')
+    return doc.serialize(pretty)
+
+
+def bench_rewrite(args):
+    rng = np.random.default_rng(args.seed)
+    for n_regions in (50, 250, 1000):
+        for pretty in (False, True):
+            html = generated_layout(rng, n_regions, pretty)
+            n_placeholders = len(LayoutDocument(html).placeholders())
+            # images with responsive attributes, sprites and kept placeholders; the last few stay unmapped
+            replacements = [None if k % 7 == 3 else ("sprite", ["sprite", f"sprite-ph{k}"]) if k % 5 == 0 else
+                            ("img", f"../../assets/{k:064x}.webp?v=1&x=\"{k}\"",
+                             {"srcset": f"a{k}.webp 100w, b{k}.webp 200w", "sizes": "12.50vw", "width": "64",
+                              "height": "64", **({"loading": "lazy"} if k % 2 else {})})
+                            for k in range(n_placeholders - 3)]
+            css = ".sprite{background-repeat:no-repeat}"
+
+            def soup():
+                doc = LayoutDocument(html)
+                count = doc.apply_replacements(replacements, css)
+                return doc.serialize(), count
+
+            t_soup, reference = best_time(soup, repeat=args.repeat)
+            t_stream, result = best_time(stream_replace_placeholders, html, replacements, css, repeat=args.repeat)
+            assert result == reference, "stream_replace_placeholders differs from the BeautifulSoup rewrite"
+            print(f"rewrite {n_regions} regions{' (pretty)' if pretty else ''}, {len(html) / 1024:.0f} KB, "
+                  f"{n_placeholders} placeholders: soup {t_soup * 1000:.1f} ms, stream {t_stream * 1000:.2f} ms "
+                  f"({t_soup / t_stream:.0f}x)")
+
+
+SUITES = {"ciou": bench_ciou, "uied_index": bench_uied_index, "assignment": bench_assignment,
+          "rewrite": bench_rewrite}
+
+
+def main():
+    args = get_args()
+    for name in args.suite or SUITES:
+        SUITES[name](args)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Runs micro-benchmarks for the pipeline's hot paths.")
+    parser.add_argument('--suite', action='append', choices=sorted(SUITES),
+                        help="Benchmark suite to run (repeatable); all suites by default.")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed repetitions per case (best is reported).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for generated inputs.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 import os
+import re
 import cv2
 import json
 import argparse
-from utils import Doubao, encode_image, image_mask
+from PIL import Image, ImageDraw
+import numpy as np
+from utils import Doubao, encode_image, image_mask, downscale_image, snap_bbox_to_edges, gray_to_gradient
 
 DEFAULT_IMAGE_PATH = "data/input/test1.png"
 DEFAULT_API_PATH = "doubao_api.txt"
@@ -13,12 +16,25 @@ PROMPT_LIST = [
     ("main content", "Please output the minimum bounding box of the main content. Please output the bounding box in the format of <bbox>x1 y1 x2 y2</bbox>. Avoid the blank space in the main content."),
 ]
 PROMPT_MERGE = "Return the bounding boxes of the sidebar, main content, header, and navigation in this webpage screenshot. Please only return the corresponding bounding boxes. Note: 1. The areas should not overlap; 2. All text information and other content should be framed inside; 3. Try to keep it compact without leaving a lot of blank space; 4. Output a label and the corresponding bounding box for each line."
+PROMPT_TILED = "This image is a grid of {n} webpage screenshots. Each screenshot is labelled 'Tile k' directly above it. For every tile, return the bounding boxes of its sidebar, main content, header, and navigation. Note: 1. The areas of one tile should not overlap and must stay inside that tile; 2. All text information and other content should be framed inside; 3. Try to keep it compact without leaving a lot of blank space; 4. Output one line per box in the format 'Tile k label: <bbox>x1 y1 x2 y2</bbox>', with coordinates relative to the whole grid image."
 BBOX_TAG_START = "<bbox>"
 BBOX_TAG_END = "</bbox>"
+COARSE_QUERY_MAX_SIDE = 512   # Longest side of the screenshot sent to the model in coarse mode
+SNAP_RADIUS_QUERY_PX = 2      # Edge search radius for refinement, in pixels of the downscaled query
+SNAP_MIN_RADIUS = 4
+BATCH_TILE_SIZE = 512         # Longest side of each screenshot inside the tiled batch image
+BATCH_LABEL_HEIGHT = 28       # Height of the label band above each tile
+BATCH_SIZE = 4                # Screenshots packed into one tiled request
+TILE_PATTERN = re.compile(r'tile\s*(\d+)\s*[:\-,.]?\s*', re.IGNORECASE)
 
 def get_args():
     parser = argparse.ArgumentParser(description="Parses bounding boxes from an image using a vision model.")
-    parser.add_argument('--run_id', type=str, required=True, help='A unique identifier for the processing run.')
+    run_group = parser.add_mutually_exclusive_group(required=True)
+    run_group.add_argument('--run_id', type=str, help='A unique identifier for the processing run.')
+    run_group.add_argument('--run_ids', type=str, nargs='+', help='Several run ids whose layouts are parsed together through tiled requests.')
+    parser.add_argument('--coarse', action='store_true', help='Query the model with a downscaled screenshot and snap the returned edges on the full-resolution image.')
+    parser.add_argument('--query_max_side', type=int, default=COARSE_QUERY_MAX_SIDE, help='Longest side (px) of the screenshot sent to the model in coarse mode.')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE, help='Number of screenshots packed into one tiled request (with --run_ids).')
     return parser.parse_args()
 
 def parse_bboxes(bbox_input: str) -> dict[str, tuple[int, int, int, int]]:
@@ -129,6 +145,38 @@ def resolve_containment(bboxes: dict[str, tuple[int, int, int, int]]) -> dict[st
 
     return {name: bbox for name, bbox in bboxes.items() if name not in removed}
 
+def refine_bboxes(image_path: str, bboxes: dict[str, tuple[int, int, int, int]],
+                  query_max_side: int = COARSE_QUERY_MAX_SIDE) -> dict[str, tuple[float, float, float, float]]:
+    """
+    Snaps coarse normalized (0-1000) bboxes to strong gradients or whitespace gutters of the
+    full-resolution image. The refined boxes stay normalized but keep sub-1/1000 precision.
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        print(f"Error: Failed to read image {image_path}")
+        return bboxes
+    h, w = image.shape[:2]
+    gradient = gray_to_gradient(image)
+    # the coarse answer is off by about one query pixel plus one normalized unit
+    query_scale = max(1.0, max(w, h) / query_max_side)
+    radius = max(SNAP_MIN_RADIUS, int(SNAP_RADIUS_QUERY_PX * query_scale + max(w, h) / 1000))
+
+    refined = {}
+    for name, norm_bbox in bboxes.items():
+        bbox_pixels = (
+            int(norm_bbox[0] * w / 1000),
+            int(norm_bbox[1] * h / 1000),
+            int(norm_bbox[2] * w / 1000),
+            int(norm_bbox[3] * h / 1000))
+        x1, y1, x2, y2 = snap_bbox_to_edges(gradient, bbox_pixels, radius)
+        refined[name] = (
+            round(x1 * 1000 / w, 3),
+            round(y1 * 1000 / h, 3),
+            round(x2 * 1000 / w, 3),
+            round(y2 * 1000 / h, 3))
+        print(f"Refined {name}: {norm_bbox} -> {refined[name]}")
+    return refined
+
 # sequential version of bbox parsing: Using recursive detection with mask
 def sequential_component_detection(image_path: str, temp_dir: str) -> dict[str, tuple[int, int, int, int]]:
     """
@@ -219,8 +267,130 @@ def main_content_processing(bboxes: dict[str, tuple[int, int, int, int]], image_
             int(bbox[3] * h / 1000))
     
     
+def build_tile_grid(image_paths: list[str], tile_size: int = BATCH_TILE_SIZE) -> tuple[Image.Image, list[tuple[int, int, int, int]]]:
+    """
+    Packs downscaled screenshots into one labelled grid image.
+    Returns the grid and the pixel rect (x, y, w, h) of every tile inside it.
+    """
+    tiles = [downscale_image(path, tile_size).convert("RGB") for path in image_paths]
+    columns = max(1, int(np.ceil(np.sqrt(len(tiles)))))
+    rows = int(np.ceil(len(tiles) / columns))
+    cell_w, cell_h = tile_size, tile_size + BATCH_LABEL_HEIGHT
+
+    grid = Image.new("RGB", (columns * cell_w, rows * cell_h), (128, 128, 128))
+    draw = ImageDraw.Draw(grid)
+    rects = []
+    for i, tile in enumerate(tiles):
+        cell_x, cell_y = (i % columns) * cell_w, (i // columns) * cell_h
+        draw.text((cell_x + 6, cell_y + 6), f"Tile {i + 1}", fill=(255, 255, 255))
+        x, y = cell_x + (cell_w - tile.width) // 2, cell_y + BATCH_LABEL_HEIGHT
+        grid.paste(tile, (x, y))
+        rects.append((x, y, tile.width, tile.height))
+    return grid, rects
+
+def parse_tiled_bboxes(bbox_input: str, tile_rects: list[tuple[int, int, int, int]],
+                       grid_size: tuple[int, int]) -> list[dict[str, tuple[float, float, float, float]]]:
+    """
+    Parses a tiled response and maps every grid-normalized box back to the
+    normalized (0-1000) coordinates of its own screenshot.
+    """
+    lines_per_tile = [[] for _ in tile_rects]
+    for line in bbox_input.strip().split('\n'):
+        match = TILE_PATTERN.search(line)
+        if not match:
+            continue
+        index = int(match.group(1)) - 1
+        if 0 <= index < len(tile_rects):
+            lines_per_tile[index].append(line[match.end():])
+
+    grid_w, grid_h = grid_size
+    results = []
+    for lines, (x, y, w, h) in zip(lines_per_tile, tile_rects):
+        tile_bboxes = {}
+        for name, (gx1, gy1, gx2, gy2) in (parse_bboxes('\n'.join(lines)) if lines else {}).items():
+            x1 = min(max((gx1 * grid_w / 1000 - x) / w * 1000, 0), 1000)
+            y1 = min(max((gy1 * grid_h / 1000 - y) / h * 1000, 0), 1000)
+            x2 = min(max((gx2 * grid_w / 1000 - x) / w * 1000, 0), 1000)
+            y2 = min(max((gy2 * grid_h / 1000 - y) / h * 1000, 0), 1000)
+            if x2 > x1 and y2 > y1:
+                tile_bboxes[name] = (round(x1, 3), round(y1, 3), round(x2, 3), round(y2, 3))
+        results.append(tile_bboxes)
+    return results
+
+def parse_single_image(client: Doubao, image_path: str, coarse: bool = False,
+                       query_max_side: int = COARSE_QUERY_MAX_SIDE) -> dict[str, tuple[int, int, int, int]]:
+    """Asks the model for the layout of one screenshot with PROMPT_MERGE."""
+    if coarse:
+        # The model answers in normalized coordinates, so a downscaled query maps back directly.
+        base64_image = encode_image(downscale_image(image_path, query_max_side))
+    else:
+        base64_image = encode_image(image_path)
+    if not base64_image:
+        print(f"Error: Failed to encode image {image_path}")
+        return {}
+    bboxes = parse_bboxes(client.ask(PROMPT_MERGE, base64_image))
+    if bboxes:
+        bboxes = resolve_containment(bboxes)
+        if coarse:
+            bboxes = refine_bboxes(image_path, bboxes, query_max_side)
+    return bboxes
+
+def batch_main(args):
+    """Parses the layouts of several runs, packing up to `batch_size` screenshots per request."""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    api_key = os.environ.get('API_key')
+    if not api_key:
+        print(f"Error: API key not found in environment variable 'API_key'")
+        exit(1)
+    client = Doubao(api_key)
+
+    runs = []
+    for run_id in args.run_ids:
+        tmp_dir = os.path.join(base_dir, 'data', 'tmp', run_id)
+        image_path = os.path.join(tmp_dir, f"{run_id}.png")
+        json_output_path = os.path.join(tmp_dir, f"{run_id}_bboxes.json")
+        if not os.path.exists(image_path):
+            print(f"Error: Input image not found at {image_path}")
+            save_bboxes_to_json({}, json_output_path)
+            continue
+        runs.append((run_id, image_path, json_output_path, os.path.join(tmp_dir, f"{run_id}_with_bboxes.png")))
+
+    for start in range(0, len(runs), args.batch_size):
+        chunk = runs[start:start + args.batch_size]
+        print(f"\n--- Parsing tiled batch of {len(chunk)} screenshots ---")
+        tiled_results = [{} for _ in chunk]
+        if len(chunk) > 1:
+            grid, rects = build_tile_grid([image_path for _, image_path, _, _ in chunk])
+            try:
+                bbox_content = client.ask(PROMPT_TILED.format(n=len(chunk)), encode_image(grid))
+                tiled_results = parse_tiled_bboxes(bbox_content or "", rects, grid.size)
+            except Exception as e:
+                # the screenshots of this chunk are parsed one by one below
+                print(f"Error: Tiled request failed: {e}")
+
+        for (run_id, image_path, json_output_path, annotated_path), bboxes in zip(chunk, tiled_results):
+            if bboxes:
+                # tiles are downscaled, so their edges always go through local refinement
+                bboxes = refine_bboxes(image_path, resolve_containment(bboxes), BATCH_TILE_SIZE)
+            else:
+                if len(chunk) > 1:
+                    print(f"Tiled parse failed for run_id: {run_id}, falling back to a single request.")
+                try:
+                    bboxes = parse_single_image(client, image_path, args.coarse, args.query_max_side)
+                except Exception as e:
+                    # an empty result keeps the remaining runs going
+                    print(f"Error: Request failed for run_id: {run_id}: {e}")
+                    bboxes = {}
+            save_bboxes_to_json(bboxes, json_output_path)
+            if bboxes:
+                draw_bboxes(image_path, bboxes, annotated_path)
+            print(f"--- Detection Complete for run_id: {run_id} ---")
+
 def main():
     args = get_args()
+    if args.run_ids:
+        batch_main(args)
+        return
     run_id = args.run_id
 
     # --- Dynamic Path Construction ---
@@ -263,21 +433,8 @@ def main():
     
     # Use environment variable if available, otherwise use file path
     client = Doubao(api_key)
-    base64_image = encode_image(image_path)
-    if not base64_image:
-        print(f"Error: Failed to encode image {image_path}")
-        # Create empty json file so the pipeline doesn't break
-        save_bboxes_to_json({}, json_output_path)
-        exit(1)
-    
-    bbox_content = client.ask(PROMPT_MERGE, base64_image)
-    bboxes = parse_bboxes(bbox_content)
-    
+    bboxes = parse_single_image(client, image_path, args.coarse, args.query_max_side)
     if bboxes:
-        print("\n--- Resolving containment issues ---")
-        bboxes = resolve_containment(bboxes)
-        print("--- Containment resolved ---")
-        
         print(f"\n--- Detection Complete for run_id: {run_id} ---")
         save_bboxes_to_json(bboxes, json_output_path)
         draw_bboxes(image_path, bboxes, annotated_image_output_path)
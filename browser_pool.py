@@ -0,0 +1,147 @@
+"""
+Long-lived headless Chromium pool for layout rendering.
+Playwright's async API is bound to one event loop, so the pool runs its own loop in a
+background thread: synchronous callers submit coroutines with `run`, and coroutines
+running on that loop borrow a fresh browser context with `async with pool.context()`.
+"""
+import asyncio
+import contextlib
+import subprocess
+import threading
+from playwright.async_api import async_playwright
+
+DEFAULT_POOL_SIZE = 2                 # Browsers kept alive
+DEFAULT_MAX_PAGES_PER_BROWSER = 100   # Contexts served before a browser is recycled
+DEFAULT_MAX_CONCURRENCY = 4           # Contexts open at the same time across the pool
+
+
+class _BrowserSlot:
+    def __init__(self, browser):
+        self.browser = browser
+        self.pages_served = 0
+        self.active = 0
+
+
+class BrowserPool:
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_pages_per_browser=DEFAULT_MAX_PAGES_PER_BROWSER,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, launch_options=None):
+        self.size = size
+        self.max_pages_per_browser = max_pages_per_browser
+        self.max_concurrency = max_concurrency
+        self.launch_options = launch_options or {"headless": True}
+        self._loop = None
+        self._thread = None
+        self._playwright = None
+        self._slots = []
+        self._semaphore = None
+        self._lock = None
+
+    # ---------- lifecycle ----------
+    def start(self):
+        """Starts the event loop thread and launches all browsers (call at service start)."""
+        if self._loop is not None:
+            return self
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="browser-pool", daemon=True)
+        self._thread.start()
+        try:
+            self.run(self._start)
+        except Exception:
+            self.close()
+            raise
+        print(f"Browser pool ready: {self.size} browser(s), max {self.max_concurrency} concurrent contexts.")
+        return self
+
+    async def _start(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._lock = asyncio.Lock()
+        self._playwright = await async_playwright().start()
+        try:
+            first = await self._launch()
+        except Exception as e:
+            # Only done once, at warm-up time; requests never wait for an install
+            print(f"Error launching browser: {e}")
+            print("Attempting to install Chromium for Playwright...")
+            result = await asyncio.to_thread(subprocess.run, ["playwright", "install", "chromium"],
+                                             capture_output=True, text=True, timeout=300)
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to install browser dependencies: {result.stderr}")
+            first = await self._launch()
+        self._slots = [first] + [await self._launch() for _ in range(self.size - 1)]
+
+    async def _launch(self):
+        return _BrowserSlot(await self._playwright.chromium.launch(**self.launch_options))
+
+    def close(self):
+        """Closes all browsers and stops the event loop thread."""
+        if self._loop is None:
+            return
+        if self._playwright is not None:
+            try:
+                self.run(self._close, timeout=30)
+            except Exception as e:
+                print(f"Error closing browser pool: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+        self._thread = None
+
+    async def _close(self):
+        for slot in self._slots:
+            with contextlib.suppress(Exception):
+                await slot.browser.close()
+        self._slots = []
+        await self._playwright.stop()
+        self._playwright = None
+
+    # ---------- usage ----------
+    def run(self, coro_fn, *args, timeout=None, **kwargs):
+        """Runs `coro_fn(*args, **kwargs)` on the pool's event loop and waits for the result."""
+        if self._loop is None:
+            raise RuntimeError("BrowserPool is not started.")
+        return asyncio.run_coroutine_threadsafe(coro_fn(*args, **kwargs), self._loop).result(timeout)
+
+    def healthy(self):
+        return self._loop is not None and bool(self._slots) and all(s.browser.is_connected() for s in self._slots)
+
+    async def _acquire_slot(self):
+        async with self._lock:
+            # replace crashed browsers and recycle idle ones that served too many pages
+            for i, slot in enumerate(self._slots):
+                worn_out = slot.pages_served >= self.max_pages_per_browser and slot.active == 0
+                if not slot.browser.is_connected() or worn_out:
+                    with contextlib.suppress(Exception):
+                        await slot.browser.close()
+                    self._slots[i] = await self._launch()
+            slot = min(self._slots, key=lambda s: (s.active, s.pages_served))
+            slot.active += 1
+            slot.pages_served += 1
+            return slot
+
+    @contextlib.asynccontextmanager
+    async def context(self, **context_options):
+        """Borrows a fresh, isolated browser context; it is closed when the block exits."""
+        async with self._semaphore:
+            slot = await self._acquire_slot()
+            ctx = None
+            try:
+                ctx = await slot.browser.new_context(**context_options)
+                yield ctx
+            finally:
+                slot.active -= 1
+                if ctx is not None:
+                    with contextlib.suppress(Exception):
+                        await ctx.close()
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_browser_pool(**pool_options):
+    """Returns the process-wide pool, starting it on first use."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = BrowserPool(**pool_options).start()
+        return _shared_pool
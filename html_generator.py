@@ -1,19 +1,46 @@
-from utils import encode_image, Doubao, Qwen_2_5_VL
+from utils import encode_image, Doubao, Qwen_2_5_VL, gray_to_gradient, split_by_gutters, perceptual_hash, hamming_distance
 from PIL import Image
-import bs4
-from threading import Thread
+from layout_document import LayoutDocument, ProgressiveWriter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 import argparse
 import json
 import os
+import hashlib
+import numpy as np
 
 # This dictionary holds the user's instructions for the current run.
 user_instruction = {"sidebar": "", "header": "", "navigation": "", "main content": ""}
 
+DEFAULT_MAX_WORKERS = 8  # Upper bound on concurrent model requests
+# Start order for code generation: the largest, slowest regions go first.
+REGION_PRIORITY = {"main content": 0, "sidebar": 1, "navigation": 2, "header": 3}
+
+# Repeated-region detection (--dedupe): leaves with near-identical pixels are generated once
+REPEAT_HASH_SIZE = 16            # 16x16 = 256-bit perceptual hash, a cheap pre-filter
+REPEAT_HASH_MAX_DISTANCE = 4     # Differing hash bits still compared pixel by pixel
+REPEAT_SIZE_TOLERANCE_PX = 2     # Width/height difference in pixels
+REPEAT_PIXEL_TOLERANCE = 24      # Grey-level difference still counted as the same pixel
+REPEAT_MAX_DIFF_RATIO = 0.005    # Share of differing pixels allowed in a repeated block
+
+CODE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cache', 'code')
+
+# Recursive subdivision of oversized leaves along whitespace gutters
+MAX_LEAF_AREA_RATIO = 0.2   # Leaves larger than this share of the screenshot are split
+MAX_SUBDIVISION_DEPTH = 3
+MIN_GUTTER_PX = 12          # Minimum blank run that separates two sub-blocks
+MIN_BLOCK_PX = 80           # Sub-blocks thinner than this are merged into a neighbour
+GUTTER_GRAD_THRESH = 10     # Gradient above this counts as content
+
 def get_args():
     parser = argparse.ArgumentParser(description="Generates an HTML layout from bounding box data.")
     parser.add_argument('--run_id', type=str, required=True, help='A unique identifier for the processing run.')
     parser.add_argument('--instructions', type=str, help='A JSON string of instructions for different components.')
+    parser.add_argument('--no_subdivide', action='store_true', help='Do not split oversized regions into sub-blocks.')
+    parser.add_argument('--no_cache', action='store_true', help='Regenerate every region instead of reusing cached code.')
+    parser.add_argument('--dedupe', action='store_true', help='Generate repeated, pixel-identical regions once and share the code.')
+    parser.add_argument('--pretty', action='store_true', help='Pretty-print the generated layout HTML.')
+    parser.add_argument('--max_workers', type=int, default=DEFAULT_MAX_WORKERS, help='Maximum number of concurrent code generation requests.')
     return parser.parse_args()
 
 def get_prompt_dict(instructions):
@@ -74,6 +101,79 @@ def get_prompt_dict(instructions):
         只需返回<div>和</div>标签内的代码"""
     }
 
+class CodeCache:
+    """
+    On-disk cache of generated region code, keyed on (crop hash, region type, prompt, model).
+    Unchanged regions reuse their code when only another region's instruction is edited.
+    """
+    def __init__(self, cache_dir=CODE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(cropped_img, node_type, prompt, model):
+        h = hashlib.sha256()
+        h.update(f"{cropped_img.mode}|{cropped_img.size}|".encode())
+        h.update(cropped_img.tobytes())
+        for part in (node_type, prompt, model):
+            h.update(b"\0" + str(part).encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.html")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, code):
+        # write-then-rename so concurrent runs never read a partial entry
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(code)
+        os.replace(tmp_path, self._path(key))
+
+def bot_model_name(bot):
+    """Returns the model identifier of a Bot, used as part of the cache key."""
+    return getattr(bot, "model", None) or getattr(bot, "name", None) or type(bot).__name__
+
+def subdivide_node(node, active, max_area, depth=0):
+    """
+    Recursively splits an oversized leaf into sub-blocks at whitespace gutters.
+    Sub-blocks inherit the parent's type so they are generated with the same prompt.
+    """
+    x1, y1, x2, y2 = node["bbox"]
+    if depth >= MAX_SUBDIVISION_DEPTH or (x2 - x1) * (y2 - y1) <= max_area:
+        return
+    roi = active[y1:y2, x1:x2]
+    # prefer cutting across the longer side of the block
+    axes = (0, 1) if (y2 - y1) >= (x2 - x1) else (1, 0)
+    for axis in axes:
+        spans = split_by_gutters(roi, axis, MIN_GUTTER_PX, MIN_BLOCK_PX)
+        if len(spans) >= 2:
+            break
+    else:
+        return
+
+    for start, end in spans:
+        if axis == 0:
+            child_bbox = [x1, y1 + start, x2, y1 + end]
+        else:
+            child_bbox = [x1 + start, y1, x1 + end, y2]
+        child = {"bbox": child_bbox, "type": node.get("type"), "children": []}
+        subdivide_node(child, active, max_area, depth + 1)
+        node["children"].append(child)
+
+def assign_ids(node, next_id=1):
+    """Assigns unique IDs to all descendants in document (pre-)order; returns the next free ID."""
+    for child in node.get("children", []):
+        child["id"] = next_id
+        next_id = assign_ids(child, next_id + 1)
+    return next_id
+
 def generate_code(bbox_tree, img_path, bot, instructions):
     """Generates code for each leaf node in the bounding box tree."""
     img = Image.open(img_path)
@@ -102,8 +202,11 @@ def generate_code(bbox_tree, img_path, bot, instructions):
     _generate_code(bbox_tree)
     return code_dict
 
-def generate_html(bbox_tree, output_file):
-    """Generates an HTML file with nested containers based on the bounding box tree."""
+def generate_html(bbox_tree, output_file=None, pretty=False):
+    """
+    Builds the layout document with nested containers based on the bounding box tree.
+    The document is returned for in-memory substitution and only written if `output_file` is given.
+    """
     html_template_start = """
     <!DOCTYPE html>
     <html lang="en">
@@ -177,80 +280,148 @@ def generate_html(bbox_tree, output_file):
         html_content += process_bbox(child, root_width, root_height, root_bbox[0], root_bbox[1])
     html_content += html_template_end
 
-    with open(output_file, 'w') as f:
-        f.write(bs4.BeautifulSoup(html_content, 'html.parser').prettify())
-def generate_code_parallel(bbox_tree, img_path, bot, instructions):
-    """generate code for all the leaf nodes in the bounding box tree, return a dictionary: {'id': 'code'}"""
+    doc = LayoutDocument(html_content)
+    if output_file:
+        doc.write(output_file, pretty)
+    return doc
+
+def collect_leaves(node):
+    """Returns the leaf nodes of a bounding box tree in document order."""
+    if not node.get("children"):
+        return [node]
+    leaves = []
+    for child in node["children"]:
+        leaves += collect_leaves(child)
+    return leaves
+
+def leaf_priority(node):
+    """Sort key that starts slow regions first: by region type, then by descending area."""
+    x1, y1, x2, y2 = node["bbox"]
+    return REGION_PRIORITY.get(node.get("type"), len(REGION_PRIORITY)), -(x2 - x1) * (y2 - y1)
+
+def same_pixels(grey, other):
+    """True if two grey crops of about the same size differ in almost no pixel."""
+    h, w = min(grey.shape[0], other.shape[0]), min(grey.shape[1], other.shape[1])
+    differing = np.abs(grey[:h, :w] - other[:h, :w]) > REPEAT_PIXEL_TOLERANCE
+    return differing.mean() <= REPEAT_MAX_DIFF_RATIO
+
+def group_repeated_jobs(jobs):
+    """
+    Groups generation jobs whose crops are near-identical: same type, same size within a few
+    pixels and almost no differing pixel (the perceptual hash only pre-filters candidates).
+    Each group keeps the job order, so the first job is its representative.
+    """
+    groups = []
+    signatures = []
+    for job in jobs:
+        node, cropped_img = job[0], job[1]
+        w, h = cropped_img.size
+        phash = perceptual_hash(cropped_img, REPEAT_HASH_SIZE)
+        grey = None
+        for group, (g_type, g_w, g_h, g_hash, g_grey) in zip(groups, signatures):
+            if g_type == node["type"] \
+                    and abs(w - g_w) <= REPEAT_SIZE_TOLERANCE_PX and abs(h - g_h) <= REPEAT_SIZE_TOLERANCE_PX \
+                    and hamming_distance(phash, g_hash) <= REPEAT_HASH_MAX_DISTANCE:
+                if grey is None:
+                    grey = np.asarray(cropped_img.convert("L"), dtype=np.int16)
+                if same_pixels(grey, g_grey):
+                    group.append(job)
+                    break
+        else:
+            if grey is None:
+                grey = np.asarray(cropped_img.convert("L"), dtype=np.int16)
+            groups.append([job])
+            signatures.append((node["type"], w, h, phash, grey))
+    return groups
+
+def generate_code_parallel(bbox_tree, img_path, bot, instructions, max_workers=DEFAULT_MAX_WORKERS, cache=None, on_result=None,
+                           dedupe_repeated=False):
+    """
+    generate code for all the leaf nodes in the bounding box tree, return a dictionary: {'id': 'code'}
+    With a CodeCache, only leaves whose (crop, type, prompt, model) changed are sent to the model.
+    With `dedupe_repeated`, pixel-identical leaves are generated once and share the code.
+    `on_result(node_id, code)` is called from the calling thread as soon as each leaf is ready.
+    """
     code_dict = {}
-    t_list = []
     prompt_dict = get_prompt_dict(instructions)
-    def _generate_code_with_retry(node, max_retries=3, retry_delay=2):
+    def _generate_code_with_retry(node, cropped_img, prompt, cache_key=None, max_retries=3, retry_delay=2):
         """Generate code with retry mechanism for rate limit errors"""
         try:
-            # Create a new image instance for each thread
-            with Image.open(img_path) as img:
-                bbox = node["bbox"]
-                cropped_img = img.crop(bbox)
-
-                # Select prompt based on node type
-                if "type" in node:
-                    if node["type"] in prompt_dict:
-                        prompt = prompt_dict[node["type"]]
-                    else:
-                        print(f"Unknown component type: {node['type']}")
-                        code_dict[node["id"]] = f"<!-- Unknown component type: {node['type']} -->"
-                        return
-                else:
-                    print("Node type not found")
-                    code_dict[node["id"]] = f"<!-- Node type not found -->"
+            for attempt in range(max_retries):
+                try:
+                    code = bot.ask(prompt, encode_image(cropped_img))
+                    code_dict[node["id"]] = code
+                    if cache is not None and code:
+                        cache.put(cache_key, code)
                     return
-                
-                for attempt in range(max_retries):
-                    try:
-                        code = bot.ask(prompt, encode_image(cropped_img))
-                        code_dict[node["id"]] = code
+                except Exception as e:
+                    if "rate_limit" in str(e).lower() and attempt < max_retries - 1:
+                        print(f"Rate limit hit, retrying in {retry_delay} seconds... (Attempt {attempt + 1}/{max_retries})")
+                        time.sleep(retry_delay)
+                        retry_delay *= 2  # Exponential backoff
+                    else:
+                        print(f"Error generating code for node {node['id']}: {str(e)}")
+                        code_dict[node["id"]] = f"<!-- Error: {str(e)} -->"
                         return
-                    except Exception as e:
-                        if "rate_limit" in str(e).lower() and attempt < max_retries - 1:
-                            print(f"Rate limit hit, retrying in {retry_delay} seconds... (Attempt {attempt + 1}/{max_retries})")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                        else:
-                            print(f"Error generating code for node {node['id']}: {str(e)}")
-                            code_dict[node["id"]] = f"<!-- Error: {str(e)} -->"
-                            return
         except Exception as e:
             print(f"Error processing image for node {node['id']}: {str(e)}")
             code_dict[node["id"]] = f"<!-- Error: {str(e)} -->"
 
-    def _generate_code(node):
-        if not node.get("children"):
-            t = Thread(target=_generate_code_with_retry, args=(node,))
-            t.start()
-            t_list.append(t)
-        else:
-            for child in node["children"]:
-                _generate_code(child)
+    # Select prompts and cut every crop from a single decoded image before any request starts
+    jobs = []
+    reused = 0
+    model = bot_model_name(bot)
+    with Image.open(img_path) as img:
+        img.load()
+        for node in sorted(collect_leaves(bbox_tree), key=leaf_priority):
+            if "type" not in node:
+                print("Node type not found")
+                code_dict[node["id"]] = f"<!-- Node type not found -->"
+            elif node["type"] not in prompt_dict:
+                print(f"Unknown component type: {node['type']}")
+                code_dict[node["id"]] = f"<!-- Unknown component type: {node['type']} -->"
+            else:
+                cropped_img = img.crop(node["bbox"])
+                prompt = prompt_dict[node["type"]]
+                cache_key = None
+                if cache is not None:
+                    cache_key = CodeCache.key(cropped_img, node["type"], prompt, model)
+                    cached = cache.get(cache_key)
+                    if cached is not None:
+                        code_dict[node["id"]] = cached
+                        reused += 1
+                        continue
+                jobs.append((node, cropped_img, prompt, cache_key))
+    if cache is not None:
+        print(f"Code cache: {reused} regions reused, {len(jobs)} to generate.")
+
+    if on_result is not None:
+        for node_id, code in list(code_dict.items()):
+            on_result(node_id, code)
+
+    groups = group_repeated_jobs(jobs) if dedupe_repeated else [[job] for job in jobs]
+    if len(groups) < len(jobs):
+        print(f"Repeated regions: {len(jobs)} leaves share {len(groups)} generations.")
+
+    # A bounded pool caps open connections; jobs are submitted in priority order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_generate_code_with_retry, *group[0]): group for group in groups}
+        for future in as_completed(futures):
+            group = futures[future]
+            node_id = group[0][0]["id"]
+            if node_id not in code_dict:
+                continue
+            code = code_dict[node_id]
+            # clone the representative's code into every repeated block; the cache keeps only
+            # code generated for a crop, so a run without --dedupe regenerates the members
+            for member, *_ in group[1:]:
+                code_dict[member["id"]] = code
+            if on_result is not None:
+                for member, *_ in group:
+                    on_result(member["id"], code)
 
-    _generate_code(bbox_tree)
-    
-    # Wait for all threads to complete
-    for t in t_list:
-        t.join()
-        
     return code_dict
 
-def code_substitution(html_file, code_dict):
-    """Substitutes the generated code into the HTML file."""
-    with open(html_file, "r") as f:
-        soup = bs4.BeautifulSoup(f.read(), 'html.parser')
-    for node_id, code in code_dict.items():
-        div = soup.find(id=node_id)
-        if div:
-            div.append(bs4.BeautifulSoup(code.replace("```html", "").replace("```", ""), 'html.parser'))
-    with open(html_file, "w") as f:
-        f.write(soup.prettify())
-
 def main():
     args = get_args()
     if args.instructions:
@@ -291,13 +462,19 @@ def main():
         y2 = int(norm_bbox[3] * height / 1000)
         root["children"].append({"bbox": [x1, y1, x2, y2], "type": name, "children": []})
     
+    if not args.no_subdivide:
+        with Image.open(img_path) as img:
+            active = gray_to_gradient(np.array(img.convert("L"))) > GUTTER_GRAD_THRESH
+        for child in root["children"]:
+            subdivide_node(child, active, MAX_LEAF_AREA_RATIO * width * height)
+
     # Assign unique IDs to all nodes for code substitution
-    next_id = 1
-    for child in root["children"]:
-        child["id"] = next_id
-        next_id += 1
+    assign_ids(root)
     
-    generate_html(root, output_html_path)
+    doc = generate_html(root)
+    # Emit the skeleton right away; regions are filled in as their code arrives
+    writer = ProgressiveWriter(doc, output_html_path, pretty=args.pretty)
+    writer.publish()
 
     # Check for API key - first try environment variable, then file
     api_key = os.environ.get('API_key')
@@ -308,8 +485,9 @@ def main():
     
     # Use environment variable if available, otherwise use file path
     bot = Doubao(api_key, model="doubao-1.5-thinking-vision-pro-250428")
-    code_dict = generate_code_parallel(root, img_path, bot, user_instruction)
-    code_substitution(output_html_path, code_dict)
+    cache = None if args.no_cache else CodeCache()
+    generate_code_parallel(root, img_path, bot, user_instruction, max_workers=args.max_workers,
+                           cache=cache, on_result=writer.fill, dedupe_repeated=args.dedupe)
 
     print(f"HTML layout with generated content saved to {os.path.basename(output_html_path)}")
     print(f"--- HTML Generation Complete for run_id: {args.run_id} ---")
@@ -1,175 +1,187 @@
-import argparse, asyncio, cv2, json, os, sys
+import argparse, asyncio, cv2, json, os, sys, urllib.request
 from pathlib import Path
 import numpy as np
 from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
+from layout_estimator import DEFAULT_MIN_CONFIDENCE, estimate_layout
 
-# ---------- Fallback HTML parsing method ----------
-def extract_bboxes_from_html_fallback(html_path: Path):
+# ---------- Offline stylesheet routing ----------
+TAILWIND_CDN_URL = "https://cdn.jsdelivr.net/npm/tailwindcss@2.2.19/dist/tailwind.min.css"
+STATIC_DIR = Path(__file__).parent.resolve() / "static"
+# External stylesheets referenced by generated layouts -> vendored local copies
+VENDORED_STYLESHEETS = {TAILWIND_CDN_URL: STATIC_DIR / "tailwind.min.css"}
+STYLE_LOAD_TIMEOUT_MS = 3000
+
+WAIT_FOR_STYLES_SCRIPT = """
+    (timeout) => Promise.race([
+        Promise.all(Array.from(document.querySelectorAll('link[rel="stylesheet"]')).map(link =>
+            link.sheet ? null : new Promise(resolve => {
+                link.addEventListener('load', resolve);
+                link.addEventListener('error', resolve);
+            }))),
+        new Promise(resolve => setTimeout(resolve, timeout)),
+    ])
+"""
+
+
+def vendor_stylesheets():
+    """Downloads missing vendored stylesheets once (setup / service start), never per request."""
+    for url, local_path in VENDORED_STYLESHEETS.items():
+        if local_path.exists():
+            continue
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        print(f"Vendoring {url} -> {local_path}")
+        with urllib.request.urlopen(url, timeout=60) as response:
+            local_path.write_bytes(response.read())
+
+
+async def route_offline(route):
     """
-    Fallback method to extract bboxes from HTML without using Playwright.
-    This is a simplified version that may not be as accurate but will allow the pipeline to continue.
+    Serves vendored stylesheets locally and blocks every other network fetch.
+    A vendored stylesheet that was never downloaded is fetched from its CDN instead, so the
+    layout is still measured with its styles.
     """
-    try:
-        with open(html_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-        
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Extract region bboxes from CSS styles
-        region_bboxes = []
-        region_containers = soup.find_all('div', class_='box')
-        for i, container in enumerate(region_containers):
-            container_id = container.get('id', f'region_{i}')
-            style = container.get('style', '')
-            
-            # Parse CSS style to extract position and size
-            # This is a simplified parser - in real scenarios, you might need a more robust CSS parser
-            left = 0
-            top = 0
-            width = 100
-            height = 100
+    url = route.request.url
+    local_path = VENDORED_STYLESHEETS.get(url)
+    if local_path is not None and local_path.exists():
+        await route.fulfill(path=str(local_path), content_type="text/css")
+    elif url.startswith("file:") or local_path is not None:
+        await route.continue_()
+    else:
+        await route.abort()
+
+
+# ---------- Main logic ----------
+LAYOUT_WIDTH = 1280          # CSS px; the height follows the screenshot's aspect ratio
+DEFAULT_BATCH_PAGES = 4      # Pages kept open in one context by the batch measurement
+
+MEASURE_SCRIPT = """
+    () => {
+        const region_containers = Array.from(document.querySelectorAll('.box[id]'));
+        const region_bboxes = region_containers.map(el => {
+            const rect = el.getBoundingClientRect();
+            return { id: el.id, x: rect.x, y: rect.y, w: rect.width, h: rect.height };
+        });
+
+        const placeholder_bboxes = [];
+        let ph_id_counter = 0;
+        const all_potential_placeholders = document.querySelectorAll('.bg-gray-400');
+
+        for (const el of all_potential_placeholders) {
+            // Apply the same filters as before
+            if (el.tagName === 'SVG') continue;
+            if (el.innerText && el.innerText.trim() !== '') continue;
             
-            if 'left:' in style:
-                left_str = style.split('left:')[1].split('%')[0].strip()
-                left = float(left_str)
-            if 'top:' in style:
-                top_str = style.split('top:')[1].split('%')[0].strip()
-                top = float(top_str)
-            if 'width:' in style:
-                width_str = style.split('width:')[1].split('%')[0].strip()
-                width = float(width_str)
-            if 'height:' in style:
-                height_str = style.split('height:')[1].split('%')[0].strip()
-                height = float(height_str)
+            const el_rect = el.getBoundingClientRect();
+            const el_center = { x: el_rect.left + el_rect.width / 2, y: el_rect.top + el_rect.height / 2 };
             
-            # Convert percentage to pixels (assuming 1280x720 viewport)
-            x = int(left * 12.8)  # 1280 / 100
-            y = int(top * 7.2)    # 720 / 100
-            w = int(width * 12.8)
-            h = int(height * 7.2)
+            // Find which region this placeholder is inside. Regions are nested
+            // (sub-blocks follow their parent in document order), so the last
+            // match is the innermost one.
+            let containing_region_id = null;
+            for (const region_el of region_containers) {
+                const region_rect = region_el.getBoundingClientRect();
+                if (el_center.x >= region_rect.left && el_center.x <= region_rect.right &&
+                    el_center.y >= region_rect.top && el_center.y <= region_rect.bottom) {
+                    containing_region_id = region_el.id;
+                }
+            }
             
-            region_bboxes.append({
-                'id': container_id,
-                'x': x,
-                'y': y,
-                'w': w,
-                'h': h
-            })
-        
-        # Extract placeholder bboxes
-        placeholder_bboxes = []
-        placeholder_images = soup.find_all(class_='bg-gray-400')
-        for i, img in enumerate(placeholder_images):
-            # For fallback, we'll use a simple approach
-            # In a real scenario, you'd need to parse the actual layout
-            placeholder_bboxes.append({
-                'id': f'ph{i}',
-                'x': 100 + i * 50,
-                'y': 100 + i * 50,
-                'w': 100,
-                'h': 100,
-                'region_id': region_bboxes[0]['id'] if region_bboxes else '1'
-            })
-        
-        return region_bboxes, placeholder_bboxes, 1280, 720
-        
-    except Exception as e:
-        print(f"Error in fallback HTML parsing: {e}")
-        return [], [], 1280, 720
+            if (containing_region_id) {
+                placeholder_bboxes.push({
+                    id: 'ph' + ph_id_counter++,
+                    x: el_rect.x,
+                    y: el_rect.y,
+                    w: el_rect.width,
+                    h: el_rect.height,
+                    region_id: containing_region_id
+                });
+            }
+        }
 
-# ---------- Main logic ----------
-async def extract_bboxes_from_html(html_path: Path):
-    async with async_playwright() as p:
-        try:
-            # Try to launch browser with headless mode for HF Spaces compatibility
-            browser = await p.chromium.launch(headless=True)
-        except Exception as e:
-            print(f"Error launching browser: {e}")
-            print("Attempting to install browser dependencies...")
+        const layout_rect = document.documentElement.getBoundingClientRect();
+        return { 
+            region_bboxes, 
+            placeholder_bboxes, 
+            layout_width: layout_rect.width, 
+            layout_height: layout_rect.height 
+        };
+    }
+"""
+
+
+def layout_viewport(image_width, image_height, layout_width=LAYOUT_WIDTH):
+    """Viewport with the screenshot's aspect ratio, so one uniform scale maps layout px to image px."""
+    return {"width": layout_width, "height": max(1, round(layout_width * image_height / image_width))}
+
+
+async def measure_layout(page, html_path: Path):
+    """
+    Loads a layout HTML into `page` and measures its region and placeholder boxes once the
+    DOM and its stylesheets are ready. Network access is handled by the context's routes.
+    """
+    await page.goto(html_path.resolve().as_uri(), wait_until="domcontentloaded")
+    await page.evaluate(WAIT_FOR_STYLES_SCRIPT, STYLE_LOAD_TIMEOUT_MS)
+    metrics = await page.evaluate(MEASURE_SCRIPT)
+    return metrics['region_bboxes'], metrics['placeholder_bboxes'], metrics['layout_width'], metrics['layout_height']
+
+
+async def _measure_in_context(ctx, jobs, pages):
+    if not all(p.exists() for p in VENDORED_STYLESHEETS.values()):
+        print("Warning: Vendored stylesheets are missing; placeholders are measured without them.")
+    await ctx.route("**/*", route_offline)
+    results = [None] * len(jobs)
+    pending = iter(enumerate(jobs))
+
+    async def worker(page):
+        # each page measures documents one after another; only the viewport changes between them
+        for i, (html_path, viewport) in pending:
             try:
-                # Try to install browser dependencies
-                import subprocess
-                result = subprocess.run(["playwright", "install", "chromium"], 
-                                      capture_output=True, text=True, timeout=300)
-                if result.returncode == 0:
-                    print("Browser dependencies installed successfully, retrying...")
-                    browser = await p.chromium.launch(headless=True)
-                else:
-                    print(f"Failed to install browser dependencies: {result.stderr}")
-                    # Return empty results to continue the pipeline
-                    return [], [], 1280, 720
-            except Exception as install_error:
-                print(f"Failed to install browser dependencies: {install_error}")
-                # Return empty results to continue the pipeline
-                return [], [], 1280, 720
-        
+                await page.set_viewport_size(viewport)
+                results[i] = await measure_layout(page, Path(html_path))
+            except Exception as e:
+                results[i] = e
+
+    workers = [await ctx.new_page() for _ in range(max(1, min(pages, len(jobs))))]
+    await asyncio.gather(*(worker(page) for page in workers))
+    return results
+
+
+async def measure_layouts(jobs, pool=None, pages=DEFAULT_BATCH_PAGES):
+    """
+    Measures many layout documents in one browser context with `pages` reused pages.
+    :param jobs: [(html_path, viewport)] with viewport dicts as returned by `layout_viewport`
+    :return: per job, (region_bboxes, placeholder_bboxes, layout_width, layout_height) or the
+             exception raised while measuring it, in job order
+    """
+    if pool is not None:
+        async with pool.context() as ctx:
+            return await _measure_in_context(ctx, jobs, pages)
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
         try:
-            ctx = await browser.new_context(
-                viewport={"width": 1280, "height": 720},
-            )
-            page = await ctx.new_page()
-            await page.goto(html_path.resolve().as_uri())
-
-            metrics = await page.evaluate("""
-                () => {
-                    const region_containers = Array.from(document.querySelectorAll('.box[id]'));
-                    const region_bboxes = region_containers.map(el => {
-                        const rect = el.getBoundingClientRect();
-                        return { id: el.id, x: rect.x, y: rect.y, w: rect.width, h: rect.height };
-                    });
-
-                    const placeholder_bboxes = [];
-                    let ph_id_counter = 0;
-                    const all_potential_placeholders = document.querySelectorAll('.bg-gray-400');
-
-                    for (const el of all_potential_placeholders) {
-                        // Apply the same filters as before
-                        if (el.tagName === 'SVG') continue;
-                        if (el.innerText && el.innerText.trim() !== '') continue;
-                        
-                        const el_rect = el.getBoundingClientRect();
-                        const el_center = { x: el_rect.left + el_rect.width / 2, y: el_rect.top + el_rect.height / 2 };
-                        
-                        // Find which region this placeholder is inside
-                        let containing_region_id = null;
-                        for (const region_el of region_containers) {
-                            const region_rect = region_el.getBoundingClientRect();
-                            if (el_center.x >= region_rect.left && el_center.x <= region_rect.right &&
-                                el_center.y >= region_rect.top && el_center.y <= region_rect.bottom) {
-                                containing_region_id = region_el.id;
-                                break; // Assume non-overlapping regions
-                            }
-                        }
-                        
-                        if (containing_region_id) {
-                            placeholder_bboxes.push({
-                                id: 'ph' + ph_id_counter++,
-                                x: el_rect.x,
-                                y: el_rect.y,
-                                w: el_rect.width,
-                                h: el_rect.height,
-                                region_id: containing_region_id
-                            });
-                        }
-                    }
-
-                    const layout_rect = document.documentElement.getBoundingClientRect();
-                    return { 
-                        region_bboxes, 
-                        placeholder_bboxes, 
-                        layout_width: layout_rect.width, 
-                        layout_height: layout_rect.height 
-                    };
-                }
-            """)
-            await browser.close()
-            return metrics['region_bboxes'], metrics['placeholder_bboxes'], metrics['layout_width'], metrics['layout_height']
-        except Exception as e:
-            print(f"Error during browser operation: {e}")
+            ctx = await browser.new_context()
+            return await _measure_in_context(ctx, jobs, pages)
+        finally:
             await browser.close()
-            # Return empty results to continue the pipeline
-            return [], [], 1280, 720
+
+
+def measure_layout_files(jobs, pool=None, pages=DEFAULT_BATCH_PAGES):
+    """Synchronous `measure_layouts`, on the pool's event loop when a started BrowserPool is given."""
+    if pool is not None:
+        return pool.run(measure_layouts, jobs, pool, pages)
+    return asyncio.run(measure_layouts(jobs, pages=pages))
+
+
+async def extract_bboxes_from_html(html_path: Path, viewport, pool=None):
+    """
+    Measures one layout in headless Chromium. With a started BrowserPool (and when running
+    on its event loop) a pooled context is used; otherwise a one-off browser is launched.
+    """
+    result, = await measure_layouts([(html_path, viewport)], pool, pages=1)
+    if isinstance(result, Exception):
+        raise result
+    return result
 
 
 def draw_bboxes_on_image(img, region_bboxes, placeholder_bboxes):
@@ -179,7 +191,7 @@ def draw_bboxes_on_image(img, region_bboxes, placeholder_bboxes):
     
     # --- Helper to draw a single box with label ---
     def draw_box_with_label(b, color, label_text):
-        x, y, w, h = b["x"], b["y"], b["w"], b["h"]
+        x, y, w, h = (int(round(b[k])) for k in ("x", "y", "w", "h"))
         # Boundary correction
         x_draw, y_draw = max(0, x), max(0, y)
         w_draw, h_draw = min(w, W - x_draw), min(h, H - y_draw)
@@ -214,10 +226,13 @@ def draw_bboxes_on_image(img, region_bboxes, placeholder_bboxes):
     return boxed
 
 
-def main():
-    args = get_args()
-    run_id = args.run_id
-
+def detect_image_boxes(run_id, pool=None, measure="auto", min_confidence=DEFAULT_MIN_CONFIDENCE):
+    """
+    Measures the placeholder layout of a run and writes the proportional bbox JSON.
+    Pass a started BrowserPool to render with a warm browser instead of launching one.
+    `measure` is "auto" (estimate first, render only when the estimate is not confident enough),
+    "browser" or "estimate".
+    """
     # --- Dynamic Path Construction ---
     base_dir = Path(__file__).parent.resolve()
     tmp_dir = base_dir / 'data' / 'tmp' / run_id
@@ -229,63 +244,67 @@ def main():
     debug_image_path = tmp_dir / f"debug_gray_bboxes_{run_id}.png"
 
     if not html_path.exists():
-        sys.exit(f"Error: HTML file not found at {html_path}")
+        raise FileNotFoundError(f"Error: HTML file not found at {html_path}")
     if not screenshot_path.exists():
-        sys.exit(f"Error: Screenshot not found at {screenshot_path}")
+        raise FileNotFoundError(f"Error: Screenshot not found at {screenshot_path}")
 
     print(f"--- Starting Image Box Detection for run_id: {run_id} ---")
     
     # Read original screenshot
     img = cv2.imread(str(screenshot_path))
     if img is None:
-        sys.exit(f"Error: Cannot read image {screenshot_path}")
+        raise ValueError(f"Error: Cannot read image {screenshot_path}")
     if img.std() < 5:
         print("Warning: The screenshot is almost pure color, it may not be the original screenshot with real thumbnails.")
 
     H, W = img.shape[:2]
+    viewport = layout_viewport(W, H)
 
-    # Parse HTML → Get bboxes
-    try:
-        region_bboxes, placeholder_bboxes, layout_width, layout_height = asyncio.run(
-            extract_bboxes_from_html(html_path)
-        )
-        print("Successfully extracted bboxes using Playwright")
-    except Exception as e:
-        print(f"Playwright failed: {e}")
-        print("Falling back to HTML parsing method...")
-        region_bboxes, placeholder_bboxes, layout_width, layout_height = extract_bboxes_from_html_fallback(html_path)
-        print("Successfully extracted bboxes using fallback method")
+    # Parse HTML → Get bboxes. The browser-free estimate is exact for the region boxes and is
+    # used on its own when every placeholder position follows from its Tailwind classes.
+    estimate = None
+    if measure != "browser":
+        estimate = estimate_layout(html_path, viewport["width"], viewport["height"])
+        print(f"Estimated layout without a browser (confidence {estimate[4]:.2f})")
+    if measure == "estimate" or estimate is not None and estimate[4] >= min_confidence:
+        region_bboxes, placeholder_bboxes, layout_width, layout_height, _ = estimate
+        print("Using the estimated layout")
+    else:
+        try:
+            if pool is not None:
+                region_bboxes, placeholder_bboxes, layout_width, layout_height = pool.run(
+                    extract_bboxes_from_html, html_path, viewport, pool
+                )
+            else:
+                region_bboxes, placeholder_bboxes, layout_width, layout_height = asyncio.run(
+                    extract_bboxes_from_html(html_path, viewport)
+                )
+            print("Successfully extracted bboxes using Playwright")
+        except Exception as e:
+            print(f"Playwright failed: {e}")
+            print("Falling back to the estimated layout...")
+            if estimate is None:
+                estimate = estimate_layout(html_path, viewport["width"], viewport["height"])
+            region_bboxes, placeholder_bboxes, layout_width, layout_height, _ = estimate
     
     if not placeholder_bboxes:
         # This is not necessarily an error; some UIs might not have placeholders.
         print("Info: No gray placeholder blocks found.")
 
-    # Calculate separate scale factors for X and Y to handle aspect ratio differences
-    scale_x = W / layout_width if layout_width > 0 else 1
-    scale_y = H / layout_height if layout_height > 0 else 1
-    
-    if abs(scale_x - scale_y) > 0.05:
-        print(f"[*] Detected different X/Y scales. X: {scale_x:.2f}, Y: {scale_y:.2f}")
-    elif abs(scale_x - 1.0) > 0.05:
-        print(f"[*] Detected uniform scale: {scale_x:.2f}")
-
+    # The viewport has the screenshot's aspect ratio, so a single scale maps layout px to image px
+    scale = W / viewport["width"]
+    if abs(layout_width - viewport["width"]) > 1 or abs(layout_height - viewport["height"]) > 1:
+        print(f"Warning: Layout measured {layout_width:.0f}x{layout_height:.0f}, "
+              f"expected the {viewport['width']}x{viewport['height']} viewport.")
+    print(f"[*] Viewport {viewport['width']}x{viewport['height']}, uniform scale: {scale:.3f}")
 
     # Scale all bboxes to the original image coordinate system
-    scaled_regions = []
-    for b in region_bboxes:
-        scaled_regions.append({
-            **b,
-            "x": int(b['x'] * scale_x), "y": int(b['y'] * scale_y),
-            "w": int(b['w'] * scale_x), "h": int(b['h'] * scale_y)
-        })
+    def to_image(b):
+        return {**b, "x": round(b['x'] * scale, 2), "y": round(b['y'] * scale, 2),
+                "w": round(b['w'] * scale, 2), "h": round(b['h'] * scale, 2)}
 
-    scaled_placeholders = []
-    for b in placeholder_bboxes:
-        scaled_placeholders.append({
-            **b,
-            "x": int(b['x'] * scale_x), "y": int(b['y'] * scale_y),
-            "w": int(b['w'] * scale_x), "h": int(b['h'] * scale_y)
-        })
+    scaled_regions = [to_image(b) for b in region_bboxes]
+    scaled_placeholders = [to_image(b) for b in placeholder_bboxes]
 
     # Draw boxes using the now-scaled data
     overlay = draw_bboxes_on_image(img, scaled_regions, scaled_placeholders)
@@ -316,6 +335,7 @@ def main():
     # Print/save bbox array
     print("\n=== BBox (proportional to image dimensions) ===")
     output_data = {
+        "viewport": {**viewport, "scale": scale},
         "regions": proportional_regions,
         "placeholders": proportional_placeholders
     }
@@ -327,12 +347,31 @@ def main():
     print(f"Success: BBox list saved to {output_json_path}")
     print(f"--- Image Box Detection Complete for run_id: {run_id} ---")
 
+def main():
+    args = get_args()
+    if args.vendor_stylesheets:
+        vendor_stylesheets()
+        if not args.run_id:
+            return
+    if not args.run_id:
+        sys.exit("Error: --run_id is required.")
+    try:
+        detect_image_boxes(args.run_id, measure=args.measure, min_confidence=args.min_confidence)
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(str(e))
+
 def get_args():
     parser = argparse.ArgumentParser(
         description="Extracts placeholder bounding boxes from an HTML file and maps them to a screenshot."
     )
-    parser.add_argument('--run_id', required=True, type=str,
+    parser.add_argument('--run_id', type=str,
                         help="A unique identifier for the processing run.")
+    parser.add_argument('--measure', choices=["auto", "browser", "estimate"], default="auto",
+                        help="How placeholder boxes are measured: estimated, rendered, or estimated with a rendering fallback.")
+    parser.add_argument('--min_confidence', type=float, default=DEFAULT_MIN_CONFIDENCE,
+                        help="Minimum estimate confidence for skipping the browser in auto mode.")
+    parser.add_argument('--vendor_stylesheets', action='store_true',
+                        help="Download the stylesheets used by generated layouts into static/ for offline rendering.")
     return parser.parse_args()
 
 # ---------- CLI ----------
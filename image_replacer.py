@@ -1,11 +1,225 @@
 import argparse
+import base64
 import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from bs4 import BeautifulSoup
+from asset_store import AssetStore, pixel_digest
+from layout_document import LayoutDocument, stream_replace_placeholders
 import cv2
+import numpy as np
 import re
 import sys
 
+CROP_FORMATS = {"webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+DEFAULT_CROP_FORMAT = "webp"
+DEFAULT_QUALITY = 85          # WebP / JPEG quality (0-100)
+DEFAULT_PNG_COMPRESSION = 6   # PNG zlib level (0-9)
+DEFAULT_MAX_WORKERS = min(8, os.cpu_count() or 1)  # Encoding is CPU bound
+DEFAULT_INLINE_MAX_BYTES = 8 * 1024  # Bundle mode: encoded crops up to this size become data URIs
+SPRITE_CLASS = "sprite"
+SPRITE_PADDING = 2            # Pixels between sprites, so scaled backgrounds do not bleed
+VARIANT_DENSITIES = (1, 1.5, 2)  # Device pixel ratios a responsive variant is encoded for
+MIN_VARIANT_RATIO = 0.8       # A variant must be this much narrower than the next one to be worth a request
+FOLD_HEIGHT = 900             # CSS px; images starting below are loaded lazily
+MIN_BOX_PX = 4                # CSS px; narrower or flatter rendered boxes (empty flex items, unsized images) are ignored
+
+
+class CropWriter:
+    """
+    Encodes and writes crops on a thread pool; OpenCV releases the GIL while encoding,
+    so crops are encoded in parallel. Every written crop is reported with its size and encode time.
+    Without `out_dir` the encoded bytes are kept in the reports instead of being written.
+    """
+    def __init__(self, out_dir, fmt=DEFAULT_CROP_FORMAT, quality=DEFAULT_QUALITY,
+                 png_compression=DEFAULT_PNG_COMPRESSION, max_workers=DEFAULT_MAX_WORKERS):
+        if fmt not in CROP_FORMATS:
+            raise ValueError(f"Unsupported crop format: {fmt}")
+        self.out_dir = Path(out_dir) if out_dir is not None else None
+        self.fmt = fmt
+        self.extension = CROP_FORMATS[fmt]
+        self.params = {
+            "webp": [cv2.IMWRITE_WEBP_QUALITY, quality],
+            "jpeg": [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1],
+            "png": [cv2.IMWRITE_PNG_COMPRESSION, png_compression],
+        }[fmt]
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+
+    def filename(self, name):
+        return f"{name}{self.extension}"
+
+    def submit(self, name, image):
+        """Queues `image` to be written as <out_dir>/<name><ext>."""
+        self._futures.append(self._executor.submit(self._write, name, image))
+
+    def _write(self, name, image):
+        start = time.perf_counter()
+        ok, buffer = cv2.imencode(self.extension, image, self.params)
+        encode_ms = (time.perf_counter() - start) * 1000
+        if not ok:
+            raise ValueError(f"Could not encode crop {name}")
+        report = {"name": name, "path": None, "bytes": len(buffer), "encode_ms": encode_ms}
+        if self.out_dir is None:
+            report["data"] = buffer.tobytes()
+        else:
+            report["path"] = self.out_dir / self.filename(name)
+            report["path"].write_bytes(buffer.tobytes())
+        return report
+
+    def close(self):
+        """Waits for all queued crops and returns their reports in submission order."""
+        results = []
+        for future in self._futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Warning: {e}")
+        self._executor.shutdown()
+        self._futures = []
+        return results
+
+
+def data_uri(data, fmt):
+    return f"data:{MIME_TYPES[fmt]};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def pack_shelves(sizes, padding=SPRITE_PADDING):
+    """
+    Shelf-packs (w, h) rectangles, tallest first, into a sheet about as wide as it is tall.
+    :return: ([(x, y)] in input order, (sheet_width, sheet_height))
+    """
+    total_area = sum((w + padding) * (h + padding) for w, h in sizes)
+    shelf_width = max(max(w for w, _ in sizes), math.ceil(math.sqrt(total_area)))
+    positions = [None] * len(sizes)
+    x = y = shelf_height = used_width = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if x and x + w > shelf_width:
+            y += shelf_height + padding
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        used_width = max(used_width, x + w)
+        x += w + padding
+        shelf_height = max(shelf_height, h)
+    return positions, (used_width, y + shelf_height)
+
+
+def bundle_crops(crops, fmt, quality, png_compression, max_workers, inline_max_bytes=DEFAULT_INLINE_MAX_BYTES):
+    """
+    Prepares crops for a single self-contained HTML file: crops whose encoding fits in
+    `inline_max_bytes` become data URIs, the others are packed into one sprite sheet that is
+    inlined once in a stylesheet and addressed with background-position / background-size.
+    :return: (sources {name: ("img", data_uri) | ("sprite", [classes])}, css, crop reports)
+    """
+    writer = CropWriter(None, fmt, quality, png_compression, max_workers)
+    for name, image in crops.items():
+        writer.submit(name, image)
+    reports = writer.close()
+    sources, large = {}, []
+    for r in reports:
+        if r["bytes"] <= inline_max_bytes:
+            sources[r["name"]] = ("img", data_uri(r["data"], fmt))
+        else:
+            large.append(r["name"])
+    if not large:
+        return sources, "", reports
+
+    positions, (sheet_w, sheet_h) = pack_shelves([(crops[n].shape[1], crops[n].shape[0]) for n in large])
+    sheet = np.full((sheet_h, sheet_w, 3), 255, dtype=np.uint8)
+    for name, (x, y) in zip(large, positions):
+        h, w = crops[name].shape[:2]
+        sheet[y:y + h, x:x + w] = crops[name][:, :, :3]
+    sprite_writer = CropWriter(None, fmt, quality, png_compression, max_workers=1)
+    sprite_writer.submit(SPRITE_CLASS, sheet)
+    sprite = sprite_writer.close()[0]
+    print(f"Sprite sheet: {len(large)} crops in {sheet_w}x{sheet_h}, {sprite['bytes'] / 1024:.1f} KB")
+
+    # percentages keep each sprite filling its element whatever size the layout gives it
+    rules = [f".{SPRITE_CLASS}{{background-image:url({data_uri(sprite['data'], fmt)});background-repeat:no-repeat}}"]
+    for name, (x, y) in zip(large, positions):
+        h, w = crops[name].shape[:2]
+        pos_x = x / (sheet_w - w) * 100 if sheet_w > w else 0
+        pos_y = y / (sheet_h - h) * 100 if sheet_h > h else 0
+        rules.append(f".{SPRITE_CLASS}-{name}{{background-size:{sheet_w / w * 100:.4f}% {sheet_h / h * 100:.4f}%;"
+                     f"background-position:{pos_x:.4f}% {pos_y:.4f}%}}")
+        sources[name] = ("sprite", [SPRITE_CLASS, f"{SPRITE_CLASS}-{name}"])
+    return sources, "\n".join(rules), reports
+
+
+def encode_params(fmt, quality, png_compression):
+    """The encoder settings that affect the bytes of a crop, as part of its asset key."""
+    return f"{fmt}|{png_compression if fmt == 'png' else quality}"
+
+
+def store_assets(store, crops, digests, fmt, quality, png_compression, max_workers):
+    """
+    Adds crops to the content-addressed asset store, encoding only those not stored yet.
+    :return: ({name: (asset key, asset path)}, crop reports of the newly encoded crops)
+    """
+    params = encode_params(fmt, quality, png_compression)
+    writer = CropWriter(None, fmt, quality, png_compression, max_workers)
+    assets = {}
+    for name, image in crops.items():
+        key = AssetStore.key(digests[name], params)
+        assets[name] = (key, store.path(key, writer.extension))
+        if not store.has(key, writer.extension):
+            writer.submit(name, image)
+    reports = writer.close()
+    for r in reports:
+        key = assets[r["name"]][0]
+        r["path"] = store.put(key, writer.extension, r.pop("data"))
+    return assets, reports
+
+
+def load_placeholder_boxes(bboxes_path):
+    """
+    Reads the rendered placeholder boxes measured by image_box_detection, in CSS px of its viewport.
+    Degenerate boxes are left out, so their images keep the native size and get no width/height.
+    :return: ({placeholder_id: (left, top, width, height)}, viewport width), empty when the boxes are unavailable
+    """
+    if not bboxes_path.exists():
+        return {}, None
+    data = json.loads(bboxes_path.read_text())
+    viewport = data.get("viewport")
+    if viewport is None:
+        print(f"Warning: {bboxes_path.name} has no viewport; re-run image_box_detection for responsive images.")
+        return {}, None
+    vw, vh = viewport["width"], viewport["height"]
+    boxes = {b["id"]: (b["x"] * vw, b["y"] * vh, b["w"] * vw, b["h"] * vh) for b in data["placeholders"]}
+    return {ph_id: box for ph_id, box in boxes.items() if min(box[2], box[3]) >= MIN_BOX_PX}, vw
+
+
+def variant_widths(native_width, display_width, densities=VARIANT_DENSITIES):
+    """Widths to encode for an image displayed `display_width` CSS px wide: one per density, never upscaled."""
+    if display_width < MIN_BOX_PX:
+        return [native_width]
+    widths = sorted({max(1, min(native_width, math.ceil(display_width * d))) for d in densities})
+    # drop variants too close to the next larger one to be worth a separate download
+    return [w for w, larger in zip(widths, widths[1:] + [math.inf]) if w < larger * MIN_VARIANT_RATIO]
+
+
+def resize_to_width(image, width):
+    h, w = image.shape[:2]
+    if width >= w:
+        return image
+    return cv2.resize(image, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+
+
+def crop_box(image, bbox, scale_x, scale_y):
+    """Crops a UIED (x, y, w, h) box, scaled to the image, clipped to its bounds."""
+    x_proc, y_proc, w_proc, h_proc = bbox
+    x1, y1 = int(x_proc * scale_x), int(y_proc * scale_y)
+    x2, y2 = int(x_proc * scale_x + w_proc * scale_x), int(y_proc * scale_y + h_proc * scale_y)
+    h_img, w_img = image.shape[:2]
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(w_img, x2), min(h_img, y2)
+    return image[y1:y2, x1:x2]
+
+
 def main():
     args = get_args()
     run_id = args.run_id
@@ -56,52 +270,89 @@ def main():
         for comp in uied_data['compos']
     }
 
-    # 2. Create a directory for cropped images
-    crop_dir = final_html_path.parent / f"cropped_images_{run_id}"
-    crop_dir.mkdir(exist_ok=True)
-    print(f"Saving cropped images to: {crop_dir.resolve()}")
-
-    # 3. Iterate through mappings and save cropped images to files
+    # 2. Crop the mapped UIED boxes
+    crops = {}
     for region_id, region_data in mapping_data.items():
         for placeholder_id, uied_id in region_data['mapping'].items():
             if uied_id not in uied_boxes:
                 print(f"Warning: UIED ID {uied_id} from mapping not found. Skipping placeholder {placeholder_id}.")
                 continue
 
-            uied_bbox = uied_boxes[uied_id]
-            
-            x_proc, y_proc, w_proc, h_proc = uied_bbox
-            x_tf = x_proc * scale_x
-            y_tf = y_proc * scale_y
-            w_tf = w_proc * scale_x
-            h_tf = h_proc * scale_y
-
-            x1, y1 = int(x_tf), int(y_tf)
-            x2, y2 = int(x_tf + w_tf), int(y_tf + h_tf)
-            
-            h_img, w_img, _ = original_image.shape
-            x1, y1 = max(0, x1), max(0, y1)
-            x2, y2 = min(w_img, x2), min(h_img, y2)
-            
-            cropped_img = original_image[y1:y2, x1:x2]
+            cropped_img = crop_box(original_image, uied_boxes[uied_id], scale_x, scale_y)
             
             if cropped_img.size == 0:
                 print(f"Warning: Cropped image for {placeholder_id} is empty. Skipping.")
                 continue
             
-            output_path = crop_dir / f"{placeholder_id}.png"
-            cv2.imwrite(str(output_path), cropped_img)
+            crops[placeholder_id] = cropped_img
 
-    # --- Phase 2: Use BeautifulSoup to Replace Placeholders by Order ---
-    
-    print("\nStarting offline HTML processing with BeautifulSoup...")
-    html_content = gray_html_path.read_text()
-    soup = BeautifulSoup(html_content, 'html.parser')
+    # 3. Downscaled variants per crop, sized from the placeholder's rendered box; the largest
+    #    keeps the placeholder's name. A single-file bundle only gets the largest one.
+    boxes, viewport_width = load_placeholder_boxes(tmp_dir / f"{run_id}_bboxes.json")
+    renditions = {}   # name -> image to encode
+    variants = {}     # placeholder_id -> [(width, name)], narrowest first
+    for ph_id, cropped_img in crops.items():
+        native_width = cropped_img.shape[1]
+        widths = variant_widths(native_width, boxes[ph_id][2]) if ph_id in boxes else [native_width]
+        if args.output_mode == "bundle":
+            widths = widths[-1:]
+        variants[ph_id] = [(w, f"{ph_id}-{w}w" if w != widths[-1] else ph_id) for w in widths]
+        for w, name in variants[ph_id]:
+            renditions[name] = resize_to_width(cropped_img, w)
+    print(f"{len(crops)} crops, {len(renditions)} renditions "
+          f"({sum(ph_id in boxes for ph_id in crops)} sized from rendered boxes)")
+
+    # 4. Identical renditions (repeated logos, icons, avatars) are encoded once and share one source
+    digests = {name: pixel_digest(img) for name, img in renditions.items()}
+    representative = {}
+    for name, digest in digests.items():
+        representative.setdefault(digest, name)
+    unique_crops = {name: renditions[name] for name in representative.values()}
+    print(f"{len(unique_crops)} unique renditions")
 
-    # 1. Find all placeholder elements by their class, in document order.
-    placeholder_elements = soup.find_all(class_='bg-gray-400')
+    # 5. Encode the unique renditions in parallel: into the shared asset store, next to the HTML or for a single-file bundle
+    css = ""
+    if args.output_mode == "assets":
+        store = AssetStore()
+        assets, crop_reports = store_assets(store, unique_crops, digests, args.format, args.quality,
+                                            args.png_compression, args.max_workers)
+        print(f"Asset store {store.root}: {len(crop_reports)} new, {len(assets) - len(crop_reports)} already stored")
+        sources = {name: ("img", Path(os.path.relpath(path, final_html_path.parent)).as_posix())
+                   for name, (key, path) in assets.items()}
+        refs = {}
+        for name, digest in digests.items():
+            key, path = assets[representative[digest]]
+            _, size, count = refs.get(key, (None, path.stat().st_size, 0))
+            refs[key] = (path.name, size, count + 1)
+        store.assign(run_id, refs)
+    elif args.output_mode == "bundle":
+        sources, css, crop_reports = bundle_crops(unique_crops, args.format, args.quality, args.png_compression,
+                                                  args.max_workers, args.inline_max_bytes)
+    else:
+        crop_dir = final_html_path.parent / f"cropped_images_{run_id}"
+        crop_dir.mkdir(exist_ok=True)
+        print(f"Saving cropped images to: {crop_dir.resolve()}")
+        writer = CropWriter(crop_dir, args.format, args.quality, args.png_compression, args.max_workers)
+        for placeholder_id, cropped_img in unique_crops.items():
+            writer.submit(placeholder_id, cropped_img)
+        crop_reports = writer.close()
+        # Use the correct relative path from HTML file to image directory
+        sources = {r["name"]: ("img", f"{crop_dir.name}/{r['path'].name}") for r in crop_reports}
+    sources = {name: sources[representative[digest]] for name, digest in digests.items()
+               if representative[digest] in sources}
 
-    # 2. Get the placeholder IDs from the mapping file in the correct, sorted order.
+    for r in crop_reports:
+        target = r['path'].name if r['path'] else r['name']
+        print(f"Encoded {target}: {r['bytes'] / 1024:.1f} KB in {r['encode_ms']:.1f} ms")
+    if crop_reports:
+        print(f"Crops: {len(crop_reports)} images, {sum(r['bytes'] for r in crop_reports) / 1024:.1f} KB total "
+              f"({args.format}), {sum(r['encode_ms'] for r in crop_reports):.1f} ms encode time")
+
+    # --- Phase 2: Replace Placeholders by Order in the layout document ---
+    
+    print("\nStarting offline HTML processing...")
+
+    # 1. Get the placeholder IDs from the mapping file in the correct, sorted order.
     def natural_sort_key(s):
         return [int(text) if text.isdigit() else text.lower() for text in re.split('([0-9]+)', s)]
 
@@ -112,49 +363,80 @@ def main():
         # Sort the placeholder IDs within each region naturally (e.g., ph1, ph2, ph10)
         sorted_ph_ids = sorted(region_mapping.keys(), key=natural_sort_key)
         ordered_placeholder_ids.extend(sorted_ph_ids)
-    
-    # 3. Check for count mismatches
-    if len(placeholder_elements) != len(ordered_placeholder_ids):
-        print(f"Warning: Mismatch in counts! Found {len(placeholder_elements)} placeholder images in HTML, but {len(ordered_placeholder_ids)} mappings.")
-    else:
-        print(f"Found {len(placeholder_elements)} placeholder images to replace.")
 
-    # 4. Iterate through both lists, create a proper <img> tag, and replace the placeholder.
-    for i, ph_element in enumerate(placeholder_elements):
-        if i >= len(ordered_placeholder_ids):
-            print(f"Warning: More placeholder images in HTML than mappings. Stopping at image {i+1}.")
-            break
-        
-        ph_id = ordered_placeholder_ids[i]
-        # Fix: Use the correct relative path from HTML file to image directory
-        relative_img_path = f"{crop_dir.name}/{ph_id}.png"
+    # 2. Build the replacement of each placeholder, in document order: an <img> tag, a sprite or none.
+    replacements = []
+    for ph_id in ordered_placeholder_ids:
+        if ph_id not in sources:
+            print(f"Warning: No image for {ph_id}. Keeping its placeholder.")
+            replacements.append(None)
+            continue
+        kind, source = sources[ph_id]
         
-        # Debug: Print the path being used
-        print(f"Setting image path for {ph_id}: {relative_img_path}")
-        
-        # --- Convert div with bg-gray-400 class to img tag ---
-        # Create a new img element
-        new_img = soup.new_tag('img')
-        new_img['src'] = relative_img_path
-        new_img['class'] = ph_element.get('class', [])
-        # Remove bg-gray-400 class and add appropriate image classes
-        if 'bg-gray-400' in new_img['class']:
-            new_img['class'].remove('bg-gray-400')
-        new_img['class'].extend(['h-full', 'object-cover'])
-        
-        # Replace the div element with the new img element
-        ph_element.replace_with(new_img)
+        if kind == "img":
+            # --- Convert div with bg-gray-400 class to img tag ---
+            attrs = {}
+            if ph_id in boxes:
+                left, top, width, height = boxes[ph_id]
+                # the 1x variant is the fallback; srcset lets the browser pick by density and viewport
+                widths = variants[ph_id]
+                source = sources[next((name for w, name in widths if w >= width), widths[-1][1])][1]
+                if len(widths) > 1:
+                    attrs["srcset"] = ", ".join(f"{sources[name][1]} {w}w" for w, name in widths)
+                    # the layout is proportional, so the placeholder keeps its share of the viewport width
+                    attrs["sizes"] = f"{width / viewport_width * 100:.2f}vw"
+                attrs["width"], attrs["height"] = str(round(width)), str(round(height))
+                if top >= FOLD_HEIGHT:
+                    attrs["loading"] = "lazy"
+            print(f"Setting image for {ph_id}: {source[:60]}")
+            replacements.append(("img", source, attrs))
+        else:
+            print(f"Setting sprite for {ph_id}")
+            replacements.append(("sprite", source))
 
-    # Save the modified HTML
-    final_html_path.write_text(str(soup))
+    # 3. Replace the placeholders, found by their class, and save the modified HTML
+    start = time.perf_counter()
+    if args.engine == "stream":
+        final_html, placeholder_count = stream_replace_placeholders(
+            gray_html_path.read_text(encoding='utf-8'), replacements, css)
+        final_html_path.write_text(final_html, encoding='utf-8')
+    else:
+        doc = LayoutDocument.from_file(gray_html_path)
+        placeholder_count = doc.apply_replacements(replacements, css)
+        doc.write(final_html_path)
+    print(f"Rewrote the layout with the {args.engine} engine in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # 4. Check for count mismatches
+    if placeholder_count != len(ordered_placeholder_ids):
+        print(f"Warning: Mismatch in counts! Found {placeholder_count} placeholder images in HTML, but {len(ordered_placeholder_ids)} mappings.")
+        if placeholder_count > len(ordered_placeholder_ids):
+            print(f"Warning: More placeholder images in HTML than mappings. Stopping at image {len(ordered_placeholder_ids) + 1}.")
+    else:
+        print(f"Found {placeholder_count} placeholder images to replace.")
     
-    print(f"\nSuccessfully replaced {min(len(placeholder_elements), len(ordered_placeholder_ids))} placeholders.")
+    print(f"\nSuccessfully replaced {min(placeholder_count, len(ordered_placeholder_ids))} placeholders.")
     print(f"Final HTML generated at {final_html_path.resolve()}")
     print(f"--- Image Replacement Complete for run_id: {run_id} ---")
 
 def get_args():
     parser = argparse.ArgumentParser(description="Replace placeholder divs in an HTML file with cropped images based on UIED mappings.")
     parser.add_argument("--run_id", type=str, required=True, help="A unique identifier for the processing run.")
+    parser.add_argument("--format", choices=sorted(CROP_FORMATS), default=DEFAULT_CROP_FORMAT,
+                        help="Image format of the cropped images.")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help="WebP/JPEG quality (0-100).")
+    parser.add_argument("--png_compression", type=int, default=DEFAULT_PNG_COMPRESSION,
+                        help="PNG compression level (0-9).")
+    parser.add_argument("--output_mode", choices=["files", "assets", "bundle"], default="files",
+                        help="'files' writes crops next to the HTML; 'bundle' writes one self-contained HTML; "
+                             "'assets' references crops by content hash in the shared store data/assets, "
+                             "outside the run directory, so the HTML is only viewable on this machine.")
+    parser.add_argument("--inline_max_bytes", type=int, default=DEFAULT_INLINE_MAX_BYTES,
+                        help="Bundle mode: crops up to this encoded size are inlined as data URIs, larger ones go to a sprite sheet.")
+    parser.add_argument("--max_workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="Threads used to encode crops.")
+    parser.add_argument("--engine", choices=["stream", "soup"], default="stream",
+                        help="'stream' rewrites placeholder tags in one pass over the HTML; "
+                             "'soup' edits a BeautifulSoup tree. Both give the same output.")
     return parser.parse_args()
 
 if __name__ == "__main__":
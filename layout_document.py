@@ -0,0 +1,323 @@
+"""
+In-memory layout document shared by the pipeline stages.
+The region skeleton is parsed once and region code and image substitutions are applied
+to the same tree; it is only serialized when written or progressively published.
+"""
+import html
+import os
+import re
+from pathlib import Path
+import bs4
+
+PLACEHOLDER_CLASS = "bg-gray-400"
+
+THINK_PATTERN = re.compile(r'<think>.*?</think>', re.S | re.I)
+FENCE_PATTERN = re.compile(r'```[a-zA-Z]*')
+TAG_PATTERN = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][\w:-]*)[^>]*?(/?)>', re.S)
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                 'param', 'source', 'track', 'wbr'}
+RAW_TEXT_ELEMENTS = {'script', 'style', 'textarea', 'pre'}
+WRAPPER_ELEMENTS = {'html', 'head', 'body'}  # document wrappers a response may put around its markup
+# Tokens of serialized layout documents: comments, declarations, processing instructions and tags
+STREAM_TOKEN_PATTERN = re.compile(
+    r'<!--.*?-->|<[!?][^>]*>|<(/?)([a-zA-Z][^\s/>]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>', re.S)
+ATTRIBUTE_PATTERN = re.compile(r'([^\s=/>"\']+)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s>]+))?')
+CDATA_ELEMENTS = {'script', 'style'}  # html.parser does not parse markup inside these
+PRESERVE_WHITESPACE_ELEMENTS = {'pre', 'textarea'}
+ASCII_WHITESPACE = ' \n\t\x0c\r'
+
+
+def _first_element(text):
+    """Start of the first element tag outside the document wrappers (<html>, <head>...</head>, <body>)."""
+    pos = 0
+    while (m := TAG_PATTERN.search(text, pos)) is not None:
+        pos = m.end()
+        closing, name, _ = m.groups()
+        if name is None or closing:
+            continue
+        name = name.lower()
+        if name == 'head':
+            close = re.compile(r'</head\s*>', re.I).search(text, pos)
+            pos = close.end() if close else pos
+        elif name not in WRAPPER_ELEMENTS:
+            return m.start()
+    return None
+
+
+def extract_html_snippet(response):
+    """
+    Extracts the markup a code prompt asked for from a raw model response.
+    Drops <think> reasoning, code fences, document wrappers and surrounding prose by keeping
+    the text from the first element to the last point where all the tags opened since are
+    closed again, checking tag balance in the same linear pass. Unclosed tags are closed at the end.
+    :return: (snippet, balanced)
+    """
+    text = THINK_PATTERN.sub('', response)
+    start = _first_element(text)
+    if start is None:
+        # no element, e.g. an error comment: keep it only if it is markup at all
+        text = FENCE_PATTERN.sub('', text).strip()
+        return (text, text.startswith('<!--')) if text.startswith('<') else ('', False)
+
+    stack, end, balanced = [], None, True
+    pos = start
+    while True:
+        m = TAG_PATTERN.search(text, pos)
+        if m is None:
+            break
+        pos = m.end()
+        closing, name, self_closing = m.groups()
+        if name is None:  # comment
+            continue
+        name = name.lower()
+        if closing:
+            if name in stack:
+                if stack[-1] != name:
+                    balanced = False
+                del stack[len(stack) - 1 - stack[::-1].index(name):]
+                if not stack:
+                    end = pos
+            elif name not in WRAPPER_ELEMENTS:
+                balanced = False  # closes an element opened before the snippet
+        elif self_closing or name in VOID_ELEMENTS:
+            if not stack:
+                end = pos
+        else:
+            if name in RAW_TEXT_ELEMENTS:
+                # content of raw text elements is not markup; jump to their end tag
+                close = re.compile(rf'</{name}\s*>', re.I).search(text, pos)
+                if close is None:
+                    stack.append(name)
+                    break
+                pos = close.end()
+                if not stack:
+                    end = pos
+                continue
+            stack.append(name)
+
+    if end is None:
+        snippet = text[start:] + ''.join(f'</{name}>' for name in reversed(stack))
+        balanced = False
+    else:
+        snippet = text[start:end]
+    if not any(f'<{name}' in snippet for name in RAW_TEXT_ELEMENTS):
+        # whitespace between tags renders as at most one space
+        snippet = re.sub(r'>\s+<', '> <', snippet)
+    return snippet.strip(), balanced
+
+
+class LayoutDocument:
+    def __init__(self, html_content):
+        self.soup = bs4.BeautifulSoup(html_content, 'html.parser')
+        # index region containers once instead of searching the tree for every substitution
+        self.regions = {el['id']: el for el in self.soup.find_all('div', id=True, class_='box')}
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(Path(path).read_text(encoding='utf-8'))
+
+    def fill_region(self, node_id, code):
+        """Appends the snippet extracted from a generated response to the region container with the given id."""
+        div = self.regions.get(str(node_id))
+        if div is None:
+            return False
+        snippet, balanced = extract_html_snippet(code)
+        if not balanced:
+            print(f"Warning: Unbalanced or missing markup in the response for region {node_id}.")
+        if snippet:
+            div.append(bs4.BeautifulSoup(snippet, 'html.parser'))
+        return True
+
+    def placeholders(self, class_name=PLACEHOLDER_CLASS):
+        """Returns all placeholder elements in document order."""
+        return self.soup.find_all(class_=class_name)
+
+    def replace_with_image(self, element, src, class_name=PLACEHOLDER_CLASS, extra_classes=('h-full', 'object-cover'),
+                           attrs=None):
+        """Replaces a placeholder element with an <img>, keeping its classes apart from the placeholder class."""
+        new_img = self.soup.new_tag('img')
+        new_img['src'] = src
+        for name, value in (attrs or {}).items():
+            new_img[name] = value
+        new_img['class'] = [c for c in element.get('class', []) if c != class_name] + list(extra_classes)
+        element.replace_with(new_img)
+        return new_img
+
+    def replace_with_background(self, element, classes, class_name=PLACEHOLDER_CLASS):
+        """Keeps a placeholder element but swaps its placeholder class for background image classes."""
+        element['class'] = [c for c in element.get('class', []) if c != class_name] + list(classes)
+        element['role'] = 'img'
+        return element
+
+    def apply_replacements(self, replacements, css="", class_name=PLACEHOLDER_CLASS):
+        """
+        Applies per-placeholder replacements in document order: None keeps the placeholder,
+        ("img", src, attrs) swaps in an <img> and ("sprite", classes) a background image.
+        :return: number of placeholders in the document
+        """
+        elements = self.placeholders(class_name)
+        for element, replacement in zip(elements, replacements):
+            if replacement is None:
+                continue
+            if replacement[0] == "img":
+                self.replace_with_image(element, replacement[1], class_name, attrs=replacement[2])
+            else:
+                self.replace_with_background(element, replacement[1], class_name)
+        if css:
+            self.add_style(css)
+        return len(elements)
+
+    def add_style(self, css):
+        """Appends a <style> block to the document head."""
+        style = self.soup.new_tag('style')
+        style.string = css
+        (self.soup.head or self.soup).append(style)
+
+    def serialize(self, pretty=False):
+        return self.soup.prettify() if pretty else str(self.soup)
+
+    def write(self, path, pretty=False):
+        Path(path).write_text(self.serialize(pretty), encoding='utf-8')
+
+
+def _parse_attributes(attr_text):
+    """Attributes of a start tag as html.parser reports them: unescaped, the last duplicate wins."""
+    attrs = {}
+    for name, value in ATTRIBUTE_PATTERN.findall(attr_text):
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        attrs[name.lower()] = html.unescape(value)
+    return attrs
+
+
+def _attribute_value(value):
+    """Quotes an attribute value like BeautifulSoup's minimal formatter."""
+    value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return '"' + value.replace('"', '&quot;') + '"'
+
+
+def _start_tag(name, attrs):
+    attr_text = ''.join(f' {key}={_attribute_value(value)}' for key, value in sorted(attrs.items()))
+    return f"<{name}{attr_text}{'/' if name in VOID_ELEMENTS else ''}>"
+
+
+def stream_replace_placeholders(html_content, replacements, css="", class_name=PLACEHOLDER_CLASS,
+                                extra_classes=('h-full', 'object-cover')):
+    """
+    Single-pass equivalent of LayoutDocument.apply_replacements for documents serialized by
+    LayoutDocument: only placeholder start tags are rewritten, the subtrees of replaced placeholders
+    are skipped, and everything else is copied through without building a tree.
+    :return: (html, number of placeholders in the document)
+    """
+    out = []
+    copied = pos = text_start = index = preserving = 0
+    skipping = []        # open elements of the placeholder subtree being dropped
+    style_pending = bool(css)
+
+    def collapse_whitespace(end):
+        # BeautifulSoup keeps whitespace-only text as a single line break or space
+        nonlocal copied
+        text = html_content[text_start:end]
+        if text not in ('', '\n', ' ') and not text.strip(ASCII_WHITESPACE) and not skipping and not preserving:
+            out.append(html_content[copied:text_start] + ('\n' if '\n' in text else ' '))
+            copied = end
+
+    while True:
+        m = STREAM_TOKEN_PATTERN.search(html_content, pos)
+        if m is None:
+            break
+        collapse_whitespace(m.start())
+        pos = text_start = m.end()
+        closing, name, attr_text = m.groups()
+        if name is None:  # comment, doctype or processing instruction
+            if m.group(0)[:9].upper() == '<!DOCTYPE':
+                # BeautifulSoup writes the doctype with a line break after it, on every serialization
+                decl = m.group(0)[2:-1]
+                out.append(html_content[copied:m.start()] +
+                           f"<!DOCTYPE {decl[8:] if decl.startswith('DOCTYPE ') else decl}>\n")
+                copied = pos
+            continue
+        name = name.lower()
+        if closing:
+            if skipping:
+                if name in skipping:
+                    del skipping[len(skipping) - 1 - skipping[::-1].index(name):]
+                if not skipping:
+                    copied = pos
+            elif name in PRESERVE_WHITESPACE_ELEMENTS and preserving:
+                preserving -= 1
+            elif name == 'head' and style_pending:
+                # the stylesheet goes last in <head>, as add_style appends it
+                out.append(html_content[copied:m.start()] + f'<style>{css}</style>')
+                copied = m.start()
+                style_pending = False
+            continue
+
+        opens = not attr_text.rstrip().endswith('/') and name not in VOID_ELEMENTS
+        if opens and name in CDATA_ELEMENTS:
+            close = re.compile(rf'</{name}\s*>', re.I).search(html_content, pos)
+            pos = close.start() if close else len(html_content)
+        attrs = _parse_attributes(attr_text) if class_name in attr_text else {}
+        classes = attrs.get('class', '').split()
+        is_placeholder = class_name in classes
+        if skipping:
+            if opens:
+                skipping.append(name)
+            index += is_placeholder
+            continue
+        if not is_placeholder:
+            preserving += opens and name in PRESERVE_WHITESPACE_ELEMENTS
+            continue
+
+        replacement = replacements[index] if index < len(replacements) else None
+        index += 1
+        if replacement is None:
+            continue
+        kept_classes = [c for c in classes if c != class_name]
+        out.append(html_content[copied:m.start()])
+        copied = pos
+        if replacement[0] == "img":
+            _, src, extra_attrs = replacement
+            out.append(_start_tag('img', {'src': src, **(extra_attrs or {}),
+                                          'class': ' '.join(kept_classes + list(extra_classes))}))
+            if opens:
+                skipping.append(name)
+        else:
+            out.append(_start_tag(name, {**attrs, 'class': ' '.join(kept_classes + list(replacement[1])),
+                                         'role': 'img'}))
+    collapse_whitespace(len(html_content))
+    if not skipping:
+        out.append(html_content[copied:])
+    if style_pending:
+        out.append(f'<style>{css}</style>')
+    return ''.join(out), index
+
+
+class ProgressiveWriter:
+    """
+    Publishes intermediate versions of a layout document while regions are being generated.
+    Every version is written to a temporary file and renamed over `path`, so readers never
+    see a partial document; `callback`, if given, also receives the serialized HTML.
+    """
+    def __init__(self, doc, path, callback=None, pretty=False):
+        self.doc = doc
+        self.path = Path(path)
+        self.callback = callback
+        self.pretty = pretty
+
+    def publish(self):
+        html = self.doc.serialize(self.pretty)
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        tmp_path.write_text(html, encoding='utf-8')
+        os.replace(tmp_path, self.path)
+        if self.callback is not None:
+            self.callback(html)
+
+    def fill(self, node_id, code):
+        """Fills one region and publishes the updated document."""
+        if self.doc.fill_region(node_id, code):
+            self.publish()
@@ -0,0 +1,532 @@
+"""
+Browser-free layout measurement for generated layouts.
+Region boxes follow exactly from the absolute percentage styles written by `generate_html`;
+placeholder boxes are approximated by a small block/flex/grid layout pass over the Tailwind
+sizing and spacing classes of the generated region code. Every placeholder carries a
+confidence that drops whenever its size or offset had to be guessed (e.g. from text length),
+so callers can skip the browser when the least confident placeholder is still trustworthy.
+"""
+import math
+import re
+import bs4
+from layout_document import LayoutDocument, PLACEHOLDER_CLASS
+
+DEFAULT_MIN_CONFIDENCE = 0.9  # Estimates at or above this are used without a browser
+UNCERTAIN_SIZE = 0.6          # Placeholder whose own size is not fixed by its classes
+UNCERTAIN_OFFSET = 0.85       # Placeholder shifted by a box whose size was estimated
+UNCERTAIN_FLOW = 0.8          # Placeholder in a wrapped or overflowing flex row (shrink is not modelled)
+
+BASE_FONT = (16, 24)          # (font size, line height) in px
+CHAR_WIDTH_EM = 0.55          # Average glyph width for text size estimates
+BREAKPOINTS = {'sm': 640, 'md': 768, 'lg': 1024, 'xl': 1280, '2xl': 1536}
+FONT_SIZES = {'xs': (12, 16), 'sm': (14, 20), 'base': (16, 24), 'lg': (18, 28), 'xl': (20, 28),
+              '2xl': (24, 32), '3xl': (30, 36), '4xl': (36, 40), '5xl': (48, 48), '6xl': (60, 60),
+              '7xl': (72, 72), '8xl': (96, 96), '9xl': (128, 128)}
+MAX_WIDTHS = {'xs': 320, 'sm': 384, 'md': 448, 'lg': 512, 'xl': 576, '2xl': 672, '3xl': 768,
+              '4xl': 896, '5xl': 1024, '6xl': 1152, '7xl': 1280, 'screen-sm': 640, 'screen-md': 768,
+              'screen-lg': 1024, 'screen-xl': 1280, 'screen-2xl': 1536}
+INLINE_TAGS = {'a', 'span', 'strong', 'b', 'em', 'i', 'small', 'label', 'code', 'abbr', 'sub', 'sup',
+               'u', 's', 'mark', 'time', 'button', 'input', 'select', 'textarea', 'br'}
+# Tailwind's preflight makes img/svg/video/canvas block-level; none of them lay out children here
+REPLACED_TAGS = {'img', 'svg', 'video', 'canvas', 'iframe', 'input', 'select', 'textarea', 'hr', 'br'}
+SKIPPED_TAGS = {'script', 'style', 'template', 'head', 'meta', 'link', 'title'}
+
+BOX_STYLE_PATTERN = re.compile(r'(left|top|width|height)\s*:\s*(-?[\d.]+)%')
+INLINE_LENGTH_PATTERN = re.compile(r'(?<![\w-])(width|height|min-height|max-width)\s*:\s*([\d.]+)(px|%|rem|vw|vh)')
+SIZE_CLASS = re.compile(r'^(min-w|min-h|max-w|max-h|w|h)-(.+)$')
+SPACING_CLASS = re.compile(r'^(-?)(p|px|py|pt|pr|pb|pl|m|mx|my|mt|mr|mb|ml)-(.+)$')
+GAP_CLASS = re.compile(r'^gap-(?:(x|y)-)?(.+)$')
+SPACE_CLASS = re.compile(r'^space-(x|y)-(.+)$')
+BORDER_CLASS = re.compile(r'^border(?:-([trbl]))?(?:-(\d+))?$')
+INSET_CLASS = re.compile(r'^(-?)(top|right|bottom|left|inset-x|inset-y|inset)-(.+)$')
+GRID_COLS_CLASS = re.compile(r'^grid-cols-(\d+)$')
+COL_SPAN_CLASS = re.compile(r'^col-span-(\d+|full)$')
+TEXT_SIZE_CLASS = re.compile(r'^text-(xs|sm|base|lg|\d?xl)$')
+FRACTION_PATTERN = re.compile(r'^(\d+)/(\d+)$')
+
+DISPLAY_CLASSES = {'block': 'block', 'inline-block': 'block', 'flex': 'flex', 'inline-flex': 'flex',
+                   'grid': 'grid', 'inline-grid': 'grid', 'inline': 'inline', 'hidden': 'none',
+                   'contents': 'block', 'table': 'block', 'flow-root': 'block'}
+# side indices: top, right, bottom, left
+SIDES = {'': (0, 1, 2, 3), 'x': (1, 3), 'y': (0, 2), 't': (0,), 'r': (1,), 'b': (2,), 'l': (3,)}
+
+
+def _length(token, axis):
+    """Parses a Tailwind size token into ('px', v), ('ratio', r), ('vw'|'vh', r) or ('auto', None)."""
+    if token == 'px':
+        return 'px', 1.0
+    if token == 'auto':
+        return 'auto', None
+    if token == 'full':
+        return 'ratio', 1.0
+    if token == 'screen':
+        return ('vw' if axis == 'x' else 'vh'), 1.0
+    m = FRACTION_PATTERN.match(token)
+    if m:
+        return 'ratio', int(m.group(1)) / int(m.group(2))
+    try:
+        return 'px', float(token) * 4
+    except ValueError:
+        return None
+
+
+def _is_placeholder(el):
+    return (PLACEHOLDER_CLASS in (el.get('class') or []) and el.name != 'svg'
+            and not el.get_text(strip=True))
+
+
+class LayoutEstimator:
+    def __init__(self, viewport_width, viewport_height):
+        self.vw = viewport_width
+        self.vh = viewport_height
+        self._styles = {}
+
+    # ---------- public ----------
+    def estimate(self, doc):
+        """
+        Estimates the layout of a LayoutDocument at this viewport.
+        :return: (region_bboxes, placeholder_bboxes, layout_width, layout_height, confidence)
+        """
+        rects, region_bboxes, found = {}, [], []
+        for el in doc.soup.find_all(class_='box', id=True):
+            parent = el.find_parent(class_='box')
+            px, py, pw, ph = rects.get(id(parent), (0, 0, self.vw, self.vh))
+            style = {k: float(v) for k, v in BOX_STYLE_PATTERN.findall(el.get('style', ''))}
+            rect = (px + style.get('left', 0) / 100 * pw, py + style.get('top', 0) / 100 * ph,
+                    style.get('width', 100) / 100 * pw, style.get('height', 100) / 100 * ph)
+            rects[id(el)] = rect
+            region_bboxes.append({'id': el['id'], 'x': rect[0], 'y': rect[1], 'w': rect[2], 'h': rect[3]})
+            if el.find(class_='box') is None:
+                # leaf region: its generated code is laid out inside the absolutely sized box
+                _, _, items, _ = self._content(el, self._style(el), rect[2], rect[3], BASE_FONT)
+                found += [dict(item, x=item['x'] + rect[0], y=item['y'] + rect[1], region_id=el['id'])
+                          for item in items]
+
+        # number placeholders in document order, like the browser measurement does
+        order = {id(el): i for i, el in enumerate(doc.placeholders())}
+        found.sort(key=lambda item: order.get(id(item['el']), len(order)))
+        placeholder_bboxes = [
+            {'id': f'ph{i}', 'x': round(item['x'], 2), 'y': round(item['y'], 2), 'w': round(item['w'], 2),
+             'h': round(item['h'], 2), 'region_id': item['region_id'], 'confidence': round(item['conf'], 3)}
+            for i, item in enumerate(found)
+        ]
+        confidence = min((b['confidence'] for b in placeholder_bboxes), default=1.0)
+        return region_bboxes, placeholder_bboxes, self.vw, self.vh, confidence
+
+    # ---------- class resolution ----------
+    def _style(self, el):
+        style = self._styles.get(id(el))
+        if style is not None:
+            return style
+        style = {'display': 'inline' if el.name in INLINE_TAGS else 'block', 'inline': el.name in INLINE_TAGS,
+                 'padding': [0.0] * 4, 'margin': [0.0] * 4, 'auto_margin': [False] * 4, 'border': [0.0] * 4,
+                 'direction': 'row', 'gap': [0.0, 0.0], 'space': [0.0, 0.0], 'cols': 1, 'span': 1,
+                 'justify': 'start', 'align': 'stretch', 'inset': [None] * 4, 'exact': True}
+        active = []
+        for cls in el.get('class') or []:
+            prefix, _, name = cls.rpartition(':')
+            if not prefix:
+                active.append((0, name))
+            elif prefix in BREAKPOINTS and self.vw >= BREAKPOINTS[prefix]:
+                active.append((BREAKPOINTS[prefix], name))
+        # responsive variants come after the base utilities in the stylesheet
+        for _, name in sorted(active, key=lambda a: a[0]):
+            self._apply_class(style, name)
+        for prop, value, unit in INLINE_LENGTH_PATTERN.findall(el.get('style', '')):
+            value = float(value)
+            length = {'px': ('px', value), 'rem': ('px', value * 16), '%': ('ratio', value / 100),
+                      'vw': ('vw', value / 100), 'vh': ('vh', value / 100)}[unit]
+            style[{'width': 'w', 'height': 'h', 'min-height': 'min-h', 'max-width': 'max-w'}[prop]] = length
+        self._styles[id(el)] = style
+        return style
+
+    def _apply_class(self, style, name):
+        if name in DISPLAY_CLASSES:
+            style['display'] = DISPLAY_CLASSES[name]
+            style['inline'] = name.startswith('inline')
+        elif name in ('flex-row', 'flex-col', 'flex-row-reverse', 'flex-col-reverse'):
+            style['direction'] = name.split('-')[1]
+            style['exact'] &= not name.endswith('reverse')
+        elif name in ('flex-wrap', 'flex-wrap-reverse', 'flex-nowrap'):
+            style['wrap'] = name != 'flex-nowrap'
+            style['exact'] &= name != 'flex-wrap-reverse'
+        elif name in ('flex-1', 'flex-auto', 'flex-grow', 'flex-grow-1'):
+            style['grow'] = True
+        elif name in ('flex-none', 'flex-grow-0'):
+            style['grow'] = False
+        elif name.startswith('justify-') and not name.startswith('justify-items'):
+            style['justify'] = name[len('justify-'):]
+        elif name.startswith('items-'):
+            style['align'] = name[len('items-'):]
+        elif name in ('absolute', 'fixed'):
+            style['position'] = 'absolute'
+        elif name in ('relative', 'static', 'sticky'):
+            style['position'] = 'static'
+        elif name in ('truncate', 'whitespace-nowrap'):
+            style['nowrap'] = True
+        elif TEXT_SIZE_CLASS.match(name):
+            style['font'] = FONT_SIZES.get(name[len('text-'):], BASE_FONT)
+        elif m := SIZE_CLASS.match(name):
+            prop, token = m.groups()
+            if prop == 'max-w':
+                style[prop] = ('px', MAX_WIDTHS[token]) if token in MAX_WIDTHS else _length(token, 'x')
+            else:
+                style[prop] = _length(token, 'x' if prop.endswith('w') else 'y')
+        elif m := SPACING_CLASS.match(name):
+            negative, prop, token = m.groups()
+            kind = 'padding' if prop[0] == 'p' else 'margin'
+            length = _length(token, 'x')
+            if length is None:
+                return
+            for side in SIDES[prop[1:]]:
+                if length[0] == 'auto':
+                    style['auto_margin'][side] = kind == 'margin'
+                elif length[0] == 'px':
+                    style[kind][side] = -length[1] if negative else length[1]
+        elif m := GAP_CLASS.match(name):
+            axis, token = m.groups()
+            length = _length(token, 'x')
+            if length and length[0] == 'px':
+                for i in ((0,) if axis == 'x' else (1,) if axis == 'y' else (0, 1)):
+                    style['gap'][i] = length[1]
+        elif m := SPACE_CLASS.match(name):
+            length = _length(m.group(2), 'x')
+            if length and length[0] == 'px':
+                style['space'][0 if m.group(1) == 'x' else 1] = length[1]
+        elif m := BORDER_CLASS.match(name):
+            side, width = m.groups()
+            for i in SIDES[side or '']:
+                style['border'][i] = float(width) if width else 1.0
+        elif m := INSET_CLASS.match(name):
+            negative, prop, token = m.groups()
+            length = _length(token, 'x')
+            sides = {'top': (0,), 'right': (1,), 'bottom': (2,), 'left': (3,), 'inset': (0, 1, 2, 3),
+                     'inset-x': (1, 3), 'inset-y': (0, 2)}[prop]
+            for i in sides:
+                style['inset'][i] = (length[0], -length[1]) if negative and length and length[1] else length
+        elif m := GRID_COLS_CLASS.match(name):
+            style['cols'] = int(m.group(1))
+        elif m := COL_SPAN_CLASS.match(name):
+            style['span'] = 10 ** 6 if m.group(1) == 'full' else int(m.group(1))
+
+    def _resolve(self, length, ref):
+        if length is None:
+            return None
+        kind, value = length
+        if kind == 'px':
+            return value
+        if kind == 'ratio':
+            return ref * value if ref is not None else None
+        if kind == 'vw':
+            return self.vw * value
+        if kind == 'vh':
+            return self.vh * value
+        return None
+
+    # ---------- layout ----------
+    def _layout(self, el, avail_w, avail_h, font, shrink=False):
+        """
+        Lays out `el` offered `avail_w` x `avail_h` (None when indefinite).
+        :return: (width, height, placeholder items relative to its border box, size_is_certain)
+        """
+        if isinstance(el, str):
+            return self._text(el, avail_w, font, False)
+        style = self._style(el)
+        if style['display'] == 'none':
+            return 0.0, 0.0, [], True
+        font = style.get('font', font)
+        pad, border = style['padding'], style['border']
+        inset_x = pad[1] + pad[3] + border[1] + border[3]
+        inset_y = pad[0] + pad[2] + border[0] + border[2]
+
+        w = self._resolve(style.get('w'), avail_w)
+        h = self._resolve(style.get('h'), avail_h)
+        if el.name in ('img', 'svg', 'video', 'canvas', 'iframe'):
+            w = w if w is not None else self._attr_px(el, 'width')
+            h = h if h is not None else self._attr_px(el, 'height')
+        max_w = self._resolve(style.get('max-w'), avail_w)
+        max_h = self._resolve(style.get('max-h'), avail_h)
+        min_h = self._resolve(style.get('min-h'), avail_h)
+        if w is not None and max_w is not None:
+            w = min(w, max_w)
+
+        w_fixed = w is not None or not (shrink or style['inline'] or el.name in REPLACED_TAGS)
+        h_fixed = h is not None
+        inner_w = (w if w is not None else min(avail_w, max_w or avail_w)) - inset_x
+        inner_h = h - inset_y if h is not None else None
+        content_w, content_h, items, certain = self._content(el, style, max(inner_w, 0.0), inner_h, font)
+        if w is None:
+            w = (inner_w if w_fixed else content_w) + inset_x
+        if h is None:
+            h = content_h + inset_y
+            if min_h is not None:
+                h = max(h, min_h)
+            if max_h is not None:
+                h = min(h, max_h)
+        certain = style['exact'] and (certain or w_fixed and h_fixed)
+
+        items = self._shift(items, pad[3] + border[3], pad[0] + border[0], True)
+        if _is_placeholder(el):
+            items.insert(0, {'el': el, 'x': 0.0, 'y': 0.0, 'w': w, 'h': h, 'conf': 1.0 if certain else UNCERTAIN_SIZE})
+        return w, h, items, certain
+
+    def _content(self, el, style, cw, ch, font):
+        """Lays out the children of `el` in its content box; returns (width, height, items, certain)."""
+        if el.name in REPLACED_TAGS:
+            if el.name in ('input', 'select', 'textarea'):
+                return min(cw, 150.0), float(font[1]), [], False
+            # unsized images take their intrinsic size, which the markup does not tell
+            return 0.0, 0.0, [], el.name in ('hr', 'br')
+        entries, absolute = [], []
+        for child in el.children:
+            if isinstance(child, bs4.Comment):
+                continue
+            if isinstance(child, bs4.NavigableString):
+                text = ' '.join(child.split())
+                if text:
+                    entries.append(text)
+            elif child.name not in SKIPPED_TAGS:
+                (absolute if self._style(child).get('position') == 'absolute' else entries).append(child)
+        if not absolute and all(isinstance(e, str) or self._is_text_run(e) for e in entries):
+            text = ' '.join(e if isinstance(e, str) else e.get_text(' ', strip=True) for e in entries)
+            return self._text(text, cw, font, style.get('nowrap', False)) if text else (0.0, 0.0, [], True)
+
+        if style['display'] == 'flex' and style['direction'] == 'row':
+            result = self._flex_row(entries, style, cw, ch, font)
+        elif style['display'] == 'grid':
+            result = self._grid(entries, style, cw, ch, font)
+        else:
+            if style['display'] != 'flex':
+                entries = self._merge_text_runs(entries)
+            result = self._column(entries, style, cw, ch, font, style['display'] == 'flex')
+        content_w, content_h, items, certain = result
+
+        for child in absolute:
+            box_h = ch if ch is not None else content_h
+            items += self._absolute(child, cw, box_h, font)
+        return content_w, content_h, items, certain
+
+    def _is_text_run(self, el):
+        """True for inline elements without placeholders, which only contribute text to a line."""
+        return (self._style(el)['display'] == 'inline' and el.name not in REPLACED_TAGS
+                and not _is_placeholder(el) and el.find(class_=PLACEHOLDER_CLASS) is None)
+
+    def _merge_text_runs(self, entries):
+        merged = []
+        for entry in entries:
+            if isinstance(entry, str) or self._is_text_run(entry):
+                text = entry if isinstance(entry, str) else entry.get_text(' ', strip=True)
+                if merged and isinstance(merged[-1], str):
+                    merged[-1] += ' ' + text
+                elif text:
+                    merged.append(text)
+            else:
+                merged.append(entry)
+        return merged
+
+    def _column(self, entries, style, cw, ch, font, flex):
+        """Block flow, or a flex column when `flex` (gaps, main-axis justification, cross alignment)."""
+        gap = style['gap'][1] if flex else 0.0
+        boxes, offset_certain = [], True
+        for entry in entries:
+            margin, auto = self._margins(entry)
+            stretch = not flex or style['align'] == 'stretch'
+            w, h, sub, c = self._layout(entry, cw - margin[1] - margin[3], ch, font, shrink=not stretch)
+            if not flex and len(entries) > 1 and not isinstance(entry, str) and self._style(entry)['inline']:
+                c = False  # inline-level boxes share lines with their siblings
+            if auto[1] and auto[3] or flex and style['align'] == 'center':
+                x = (cw - w) / 2
+            elif auto[3] or flex and style['align'] == 'end':
+                x = cw - w - margin[1]
+            else:
+                x = margin[3]
+            boxes.append([entry, x, w, h, sub, c, margin])
+
+        total = sum(b[3] + b[6][0] + b[6][2] for b in boxes) + (gap + style['space'][1]) * max(len(boxes) - 1, 0)
+        y, spacing = self._distribute(style['justify'] if flex else 'start', (ch - total) if ch is not None else 0.0,
+                                      len(boxes))
+        certain, right, items = True, 0.0, []
+        if flex and style['justify'] != 'start' and not all(b[5] for b in boxes):
+            offset_certain = False
+        for i, (entry, x, w, h, sub, c, margin) in enumerate(boxes):
+            if i:
+                y += gap + style['space'][1] + spacing
+            y += margin[0]
+            items += self._shift(sub, x, y, offset_certain)
+            offset_certain &= c
+            certain &= c
+            y += h + margin[2]
+            right = max(right, x + w + margin[1])
+        return right, max(y, total), items, certain
+
+    def _flex_row(self, entries, style, cw, ch, font):
+        gap = style['gap'][0] + style['space'][0]
+        boxes = []
+        for entry in entries:
+            margin, auto = self._margins(entry)
+            grow = not isinstance(entry, str) and self._style(entry).get('grow', False)
+            w, h, sub, c = self._layout(entry, cw, ch, font, shrink=True)
+            boxes.append([entry, grow, w, h, sub, c, margin, auto])
+
+        # flex-wrap starts a new line before the first item that does not fit
+        lines, used = [[]], 0.0
+        for b in boxes:
+            outer = b[2] + b[6][1] + b[6][3]
+            if style.get('wrap') and lines[-1] and used + gap + outer > cw + 0.5:
+                lines.append([])
+            used = (used + gap if lines[-1] else 0.0) + outer
+            lines[-1].append(b)
+        cross_definite = len(lines) == 1 and ch is not None and style.get('h') is not None
+
+        y, right, items, certain, overflow = 0.0, 0.0, [], True, False
+        for i, line in enumerate(lines):
+            if i:
+                y += style['gap'][1]
+            w, h, sub, c, free = self._flex_line(line, style, cw, ch, font, gap, cross_definite)
+            items += self._shift(sub, 0.0, y, certain)  # below lines of estimated height
+            y += h
+            right = max(right, w)
+            certain &= c
+            overflow |= free < -0.5
+        if len(lines) > 1 or overflow:
+            # real items would shrink or sit on other lines when the estimated widths are slightly off
+            items = [dict(item, conf=item['conf'] * UNCERTAIN_FLOW) for item in items]
+        return right, y, items, certain and not overflow
+
+    def _flex_line(self, boxes, style, cw, ch, font, gap, cross_definite):
+        """Lays out one line of a flex row; returns (width, cross size, items, certain, free space)."""
+        free = cw - sum(b[2] + b[6][1] + b[6][3] for b in boxes) - gap * max(len(boxes) - 1, 0)
+        growers = [b for b in boxes if b[1]]
+        if growers and free > 0:
+            share = free / len(growers)
+            for b in growers:
+                b[2], b[3], b[4], c = self._layout(b[0], b[2] + share, ch, font)
+                b[5] = b[5] and c
+            free = 0.0
+
+        # auto margins take the free space before justify-content does
+        auto_count = sum(b[7][1] + b[7][3] for b in boxes)
+        x, spacing = (0.0, 0.0) if auto_count else self._distribute(style['justify'], free, len(boxes))
+        cross = ch if cross_definite else max((b[3] + b[6][0] + b[6][2] for b in boxes), default=0.0)
+        widths_certain = all(b[5] for b in boxes)
+        # with start/between packing the first item sits at the edge whatever its siblings measure
+        offset_certain = widths_certain or style['justify'] in ('start', 'between') and not auto_count
+        items = []
+        for i, (entry, _, w, h, sub, c, margin, auto) in enumerate(boxes):
+            if i:
+                x += gap + spacing
+            x += margin[3] + (free / auto_count if auto[3] and free > 0 else 0.0)
+            if style['align'] == 'center':
+                y = (cross - h) / 2
+            elif style['align'] == 'end':
+                y = cross - h - margin[2]
+            else:
+                y = margin[0]
+                if style['align'] == 'stretch' and not isinstance(entry, str) and self._style(entry).get('h') is None:
+                    self._stretch(sub, entry, cross - margin[0] - margin[2])
+            cross_certain = cross_definite or widths_certain or style['align'] not in ('center', 'end')
+            items += self._shift(sub, x, y, offset_certain and cross_certain)
+            if style['justify'] == 'start' and not auto_count:
+                offset_certain &= c
+            else:
+                offset_certain = widths_certain
+            x += w + margin[1] + (free / auto_count if auto[1] and free > 0 else 0.0)
+        return min(x, cw) if free < 0 else x, cross, items, widths_certain, free
+
+    def _grid(self, entries, style, cw, ch, font):
+        cols = max(style['cols'], 1)
+        gap_x, gap_y = style['gap']
+        col_w = (cw - gap_x * (cols - 1)) / cols
+        rows, row, used = [], [], 0
+        for entry in entries:
+            span = min(self._style(entry)['span'], cols) if not isinstance(entry, str) else 1
+            if used + span > cols:
+                rows.append(row)
+                row, used = [], 0
+            w_avail = col_w * span + gap_x * (span - 1)
+            w, h, sub, c = self._layout(entry, w_avail, None, font)
+            row.append((entry, used * (col_w + gap_x), w_avail, h, sub, c))
+            used += span
+        if row:
+            rows.append(row)
+
+        y, items, offset_certain = 0.0, [], True
+        for r, row in enumerate(rows):
+            if r:
+                y += gap_y
+            row_h = max(b[3] for b in row)
+            for entry, x, w_avail, h, sub, c in row:
+                if not isinstance(entry, str) and self._style(entry).get('h') is None and style['align'] == 'stretch':
+                    self._stretch(sub, entry, row_h)
+                items += self._shift(sub, x, y, offset_certain)
+            offset_certain &= all(b[5] for b in row)
+            y += row_h
+        return cw, y, items, offset_certain
+
+    def _absolute(self, el, cw, ch, font):
+        """Positions an absolutely positioned child against the padding box of its parent."""
+        style = self._style(el)
+        top, right, bottom, left = (self._resolve(v, ref) for v, ref in zip(style['inset'], (ch, cw, ch, cw)))
+        avail_w = cw - (left or 0) - (right or 0) if style.get('w') is None and None not in (left, right) else cw
+        w, h, sub, c = self._layout(el, avail_w, ch, font, shrink=None in (left, right))
+        x = left if left is not None else cw - right - w if right is not None else 0.0
+        y = top if top is not None else ch - bottom - h if bottom is not None else 0.0
+        # the containing block is assumed to be the parent, which is only usually true
+        return [dict(item, conf=item['conf'] * UNCERTAIN_OFFSET) for item in self._shift(sub, x, y, c)]
+
+    # ---------- helpers ----------
+    def _text(self, text, cw, font, nowrap):
+        size, line_height = font
+        width = len(text) * size * CHAR_WIDTH_EM
+        lines = 1 if nowrap or cw <= 0 else max(1, math.ceil(width / cw))
+        return (min(width, cw) if cw > 0 else width), float(lines * line_height), [], False
+
+    def _margins(self, entry):
+        if isinstance(entry, str):
+            return [0.0] * 4, [False] * 4
+        style = self._style(entry)
+        return style['margin'], style['auto_margin']
+
+    @staticmethod
+    def _attr_px(el, name):
+        try:
+            return float(str(el.get(name, '')).replace('px', ''))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _distribute(justify, free, count):
+        """Returns (leading offset, extra spacing between items) for a justify-content value."""
+        if free <= 0 or count == 0:
+            return 0.0, 0.0
+        if justify == 'center':
+            return free / 2, 0.0
+        if justify == 'end':
+            return free, 0.0
+        if justify == 'between':
+            return (0.0, free / (count - 1)) if count > 1 else (0.0, 0.0)
+        if justify == 'around':
+            return free / count / 2, free / count
+        if justify == 'evenly':
+            return free / (count + 1), free / (count + 1)
+        return 0.0, 0.0
+
+    @staticmethod
+    def _stretch(items, el, height):
+        """Stretches a placeholder that is itself the stretched flex/grid item."""
+        if items and items[0]['el'] is el:
+            items[0]['h'] = height
+
+    @staticmethod
+    def _shift(items, dx, dy, offset_certain):
+        factor = 1.0 if offset_certain else UNCERTAIN_OFFSET
+        return [dict(item, x=item['x'] + dx, y=item['y'] + dy, conf=item['conf'] * factor) for item in items]
+
+
+def estimate_layout(html, viewport_width, viewport_height):
+    """
+    Estimates region and placeholder boxes for a layout HTML path or LayoutDocument.
+    :return: (region_bboxes, placeholder_bboxes, layout_width, layout_height, confidence)
+    """
+    doc = html if isinstance(html, LayoutDocument) else LayoutDocument.from_file(html)
+    return LayoutEstimator(viewport_width, viewport_height).estimate(doc)
@@ -4,9 +4,54 @@ import os
 import json
 import uuid
 import shutil
+import threading
 from PIL import Image
 from pathlib import Path
 
+# Warm headless browser shared by all runs of this process (see warm_up).
+BROWSER_POOL = None
+WARMED_UP = False  # warm_up runs once per process; a failed start is not retried per request
+WARM_UP_LOCK = threading.Lock()
+
+def warm_up():
+    """
+    Vendors the layout stylesheets and starts the shared browser pool, once per process.
+    Concurrent callers wait for the single warm-up instead of launching their own pool.
+    Without Playwright/Chromium the pipeline keeps running image_box_detection as a script.
+    """
+    global BROWSER_POOL, WARMED_UP
+    with WARM_UP_LOCK:
+        if WARMED_UP:
+            return BROWSER_POOL
+        try:
+            import image_box_detection
+            image_box_detection.vendor_stylesheets()
+        except Exception as e:
+            print(f"Warning: Could not vendor layout stylesheets: {e}")
+        try:
+            from browser_pool import get_browser_pool
+            BROWSER_POOL = get_browser_pool()
+        except Exception as e:
+            print(f"Warning: Could not start the browser pool, layout rendering will launch a browser per run: {e}")
+        WARMED_UP = True
+    return BROWSER_POOL
+
+def start_warm_up():
+    """
+    Warms up on a background thread at service start. Requests never wait for it: until the
+    pool is ready, run_image_box_detection runs the script instead.
+    """
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+def run_image_box_detection(run_id):
+    """Measures placeholders with the warm browser pool when available, else via the script."""
+    if BROWSER_POOL is None or not BROWSER_POOL.healthy():
+        run_script_with_run_id("image_box_detection.py", run_id)
+        return
+    print("\n--- Running image_box_detection in-process with the browser pool ---")
+    import image_box_detection
+    image_box_detection.detect_image_boxes(run_id, pool=BROWSER_POOL)
+
 # This function is now more robust, injecting the prompt into a temporary copy of the generator.
 def inject_prompt_to_generator(prompt_text, temp_generator_path):
     if not prompt_text:
@@ -71,6 +116,7 @@ def generate_html_for_demo(image_path, instructions):
     - Creates a unique run_id for each call.
     - Sets up temporary directories for input and output.
     - Cleans up temporary directories after execution.
+    - Measures with the shared browser pool once start_warm_up has made it ready.
     """
     run_id = str(uuid.uuid4())
     print(f"--- Starting Screencoder workflow for run_id: {run_id} ---")
@@ -99,7 +145,7 @@ def generate_html_for_demo(image_path, instructions):
         run_script_with_run_id("UIED/run_single.py", run_id)
         run_script_with_run_id("block_parsor.py", run_id)
         run_script_with_run_id("html_generator.py", run_id, instructions)
-        run_script_with_run_id("image_box_detection.py", run_id)
+        run_image_box_detection(run_id)
         run_script_with_run_id("mapping.py", run_id)
         run_script_with_run_id("image_replacer.py", run_id)
 
@@ -141,6 +187,7 @@ def generate_html_for_demo(image_path, instructions):
 def main():
     """Main function to run the entire Screencoder workflow (legacy)."""
     print("Starting the Screencoder full workflow (legacy)...")
+    warm_up()
     # This main function is now considered legacy and should not be used in HF Spaces.
     run_id = "test1"  # Hardcoded for legacy main
     # Use a dummy image path for legacy run
@@ -150,4 +197,7 @@ def main():
     print("\nScreencoder workflow completed successfully!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+else:
+    # Service start: the demo app imports this module once, before serving any request
+    start_warm_up()
\ No newline at end of file
@@ -5,13 +5,23 @@ import json, argparse, numpy as np, cv2
 from pathlib import Path
 from typing import List, Dict
 from collections import defaultdict
-from sklearn.linear_model import RANSACRegressor
 from scipy.spatial.distance import cdist
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 import sys
 
 CIOU_STRICT = -0.9      # Min CIoU score for a valid one-to-one mapping
 FILTER_MIN_WH = 10     # UIED filter: ignore boxes smaller than this
+MATCH_GATE = 0.5        # Candidate pairs overlap or have centers within MATCH_GATE * their mean diagonal
+DENSE_MAX_CELLS = 40_000   # Regions with a smaller cost matrix are solved in one dense assignment
+EXACT_MAX_CELLS = 250_000  # Components with a larger cost matrix are matched greedily
+RANSAC_NEIGHBORS = 3    # Candidate UIED centers per placeholder for the local transform fit
+RANSAC_HYPOTHESES = 512 # Max two-point hypotheses scored per region
+RANSAC_INLIER_RATIO = 0.25  # Inlier: center residual <= this * placeholder short side ...
+RANSAC_MIN_INLIER_PX = 8    # ... but at least this many pixels
+RANSAC_SCALE_RANGE = (0.5, 2.0)  # Fitted scale allowed relative to the image-shape scale
+RANSAC_MIN_INLIERS = 3  # Inlier placeholders needed to trust a fit: any two fit the 4-DOF model exactly
 
 # Tools
 def ciou(a, b):
@@ -62,10 +72,121 @@ def ciou(a, b):
     ciou_val = iou_val - distance_penalty - aspect_ratio_penalty
     return ciou_val
 
+def _ciou_broadcast(a, b, dtype):
+    """`ciou` of (..., 4) box arrays `a` and `b` broadcast against each other."""
+    epsilon = 1e-7
+    xa, ya, wa, ha = (a[..., k] for k in range(4))
+    xb, yb, wb, hb = (b[..., k] for k in range(4))
+
+    # Standard IoU
+    inter_w = np.clip(np.minimum(xa + wa, xb + wb) - np.maximum(xa, xb), 0, None)
+    inter_h = np.clip(np.minimum(ya + ha, yb + hb) - np.maximum(ya, yb), 0, None)
+    intersection_area = inter_w * inter_h
+    union_area = wa * ha + wb * hb - intersection_area
+    iou_val = intersection_area / (union_area + epsilon)
+
+    # Center distance over enclosing box diagonal
+    center_distance_sq = (xa + wa / 2 - xb - wb / 2) ** 2 + (ya + ha / 2 - yb - hb / 2) ** 2
+    enclose_diag_sq = ((np.maximum(xa + wa, xb + wb) - np.minimum(xa, xb)) ** 2
+                       + (np.maximum(ya + ha, yb + hb) - np.minimum(ya, yb)) ** 2)
+    distance_penalty = center_distance_sq / (enclose_diag_sq + epsilon)
+
+    # Aspect ratio consistency: arctan is evaluated on the (unbroadcast) box arrays
+    v = dtype(4 / (np.pi ** 2)) * (np.arctan(wa / (ha + epsilon)) - np.arctan(wb / (hb + epsilon))) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = np.nan_to_num(v / (1 - iou_val + v + epsilon), nan=0.0)
+
+    return iou_val - distance_penalty - alpha * v
+
+def ciou_matrix(a_boxes, b_boxes, dtype=np.float32):
+    """
+    Vectorized `ciou` for every pair of boxes, computed with broadcasting.
+    `a_boxes` (n, 4), `b_boxes` (m, 4): bounding boxes in format (x, y, w, h).
+    Returns an (n, m) matrix with entry [i, j] = ciou(a_boxes[i], b_boxes[j]).
+    """
+    a = np.asarray(a_boxes, dtype=dtype).reshape(-1, 4)
+    b = np.asarray(b_boxes, dtype=dtype).reshape(-1, 4)
+    return _ciou_broadcast(a[:, None, :], b[None, :, :], dtype)
+
+def ciou_pairs(a_boxes, b_boxes, dtype=np.float32):
+    """Vectorized `ciou` of corresponding rows: entry [k] = ciou(a_boxes[k], b_boxes[k])."""
+    a = np.asarray(a_boxes, dtype=dtype).reshape(-1, 4)
+    b = np.asarray(b_boxes, dtype=dtype).reshape(-1, 4)
+    return _ciou_broadcast(a, b, dtype)
+
 def center(box):
     x, y, w, h = box
     return np.array([x + w / 2, y + h / 2])
 
+class GridIndex:
+    """
+    Uniform grid over 2D points, built once and answering "points inside rect R" and
+    nearest-point queries by visiting only the cells around the query.
+    """
+    def __init__(self, points, cell_size=None):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(self.points) == 0:
+            self.origin, self.cell_size, self.shape, self.cells = np.zeros(2), 1.0, (0, 0), {}
+            return
+        self.origin = self.points.min(axis=0)
+        extent = np.maximum(self.points.max(axis=0) - self.origin, 1.0)
+        # about two points per cell on average
+        self.cell_size = float(cell_size or max(np.sqrt(extent[0] * extent[1] * 2 / len(self.points)), 1.0))
+        cell_xy = ((self.points - self.origin) // self.cell_size).astype(int)
+        self.shape = tuple(int(v) + 1 for v in cell_xy.max(axis=0))
+        # bucket point indices by cell with one stable sort (indices stay ascending per cell)
+        keys = cell_xy[:, 0] * self.shape[1] + cell_xy[:, 1]
+        order = np.argsort(keys, kind='stable')
+        cell_keys, starts = np.unique(keys[order], return_index=True)
+        self.cells = {divmod(int(k), self.shape[1]): idx for k, idx in zip(cell_keys, np.split(order, starts[1:]))}
+
+    def _cell(self, x, y):
+        return int((x - self.origin[0]) // self.cell_size), int((y - self.origin[1]) // self.cell_size)
+
+    def query_rect(self, x, y, w, h):
+        """Sorted indices of the points with x <= px <= x + w and y <= py <= y + h."""
+        if not self.cells:
+            return np.array([], dtype=int)
+        (x1, y1), (x2, y2) = self._cell(x, y), self._cell(x + w, y + h)
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, self.shape[0] - 1), min(y2, self.shape[1] - 1)
+        found = [self.cells[cx, cy] for cx in range(x1, x2 + 1) for cy in range(y1, y2 + 1) if (cx, cy) in self.cells]
+        if not found:
+            return np.array([], dtype=int)
+        idx = np.concatenate(found)
+        px, py = self.points[idx, 0], self.points[idx, 1]
+        return np.sort(idx[(px >= x) & (px <= x + w) & (py >= y) & (py <= y + h)])
+
+    def _ring(self, qx, qy, ring):
+        """Occupied cells at Chebyshev distance `ring` from cell (qx, qy), clipped to the grid."""
+        nx, ny = self.shape
+        xs = range(max(qx - ring, 0), min(qx + ring, nx - 1) + 1)
+        ys = range(max(qy - ring + 1, 0), min(qy + ring - 1, ny - 1) + 1)
+        cells = [(cx, cy) for cy in {qy - ring, qy + ring} if 0 <= cy < ny for cx in xs]
+        cells += [(cx, cy) for cx in {qx - ring, qx + ring} if 0 <= cx < nx for cy in ys]
+        return [self.cells[c] for c in cells if c in self.cells]
+
+    def nearest(self, queries):
+        """Index of the nearest point for every query point (lowest index on ties, like argmin)."""
+        queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+        result = np.full(len(queries), -1, dtype=int)
+        if not self.cells:
+            return result
+        for q, (x, y) in enumerate(queries):
+            qx, qy = self._cell(x, y)
+            last_ring = max(qx, self.shape[0] - 1 - qx, qy, self.shape[1] - 1 - qy)
+            best = (np.inf, -1)
+            for ring in range(last_ring + 1):
+                for idx in self._ring(qx, qy, ring):
+                    d = np.hypot(self.points[idx, 0] - x, self.points[idx, 1] - y)
+                    j = np.lexsort((idx, d))[0]
+                    best = min(best, (d[j], idx[j]))
+                # every point beyond this ring is at least `ring` cells away from the query
+                if best[1] >= 0 and best[0] <= ring * self.cell_size:
+                    break
+            result[q] = best[1]
+        return result
+
 def load_regions_and_placeholders(p: Path, W_img, H_img):
     """
     Loads region and placeholder data from the specified JSON file.
@@ -104,28 +225,33 @@ def load_uied_boxes(p: Path):
         # print(d["id"], d["column_min"], d["row_min"], w, h)
     return items, shape
 
-def estimate_global_transform(pixel_placeholders, uied_boxes, uied_shape, W_orig, H_orig):
+def build_uied_index(uied_boxes, uied_shape, W_orig, H_orig):
+    """Grid index over the UIED box centers scaled to the original screenshot (no translation)."""
+    H_proc, W_proc, _ = uied_shape
+    boxes = np.array([u["bbox"] for u in uied_boxes], dtype=float).reshape(-1, 4)
+    centers = (boxes[:, :2] + boxes[:, 2:] / 2) * [W_orig / W_proc, H_orig / H_proc]
+    return GridIndex(centers)
+
+def estimate_global_transform(pixel_placeholders, uied_boxes, uied_shape, W_orig, H_orig, index=None):
     """
     Estimates a global affine transform from the UIED coordinate space to the
     original screenshot's coordinate space. This is used for rough alignment.
+    `index` is the run's `build_uied_index` result; it is built here when not given.
     """
     # 1. Calculate base scaling from image dimension ratios
     H_proc, W_proc, _ = uied_shape
     scale_x = W_orig / W_proc
     scale_y = H_orig / H_proc
-    
-    # 2. Apply this scaling to all UIED boxes
-    uied_scaled = [{**u, "bbox": (u["bbox"][0]*scale_x, u["bbox"][1]*scale_y, u["bbox"][2]*scale_x, u["bbox"][3]*scale_y)} for u in uied_boxes]
 
-    # 3. Estimate residual translation (dx, dy) by matching centers
-    if not pixel_placeholders or not uied_scaled:
+    # 2. Estimate residual translation (dx, dy) by matching centers
+    if not pixel_placeholders or not uied_boxes:
         return scale_x, scale_y, 0, 0
+    if index is None:
+        index = build_uied_index(uied_boxes, uied_shape, W_orig, H_orig)
 
     ph_centers = np.array([center(p["bbox"]) for p in pixel_placeholders])
-    uied_scaled_centers = np.array([center(u["bbox"]) for u in uied_scaled])
-    
-    indices = cdist(ph_centers, uied_scaled_centers).argmin(axis=1)
-    translations = ph_centers - uied_scaled_centers[indices]
+    indices = index.nearest(ph_centers)
+    translations = ph_centers - index.points[indices]
     dx, dy = np.median(translations, axis=0)
     
     return scale_x, scale_y, dx, dy
@@ -135,57 +261,201 @@ def apply_affine_transform(box, scale_x, scale_y, dx, dy):
     return (x * scale_x + dx, y * scale_y + dy, w * scale_x, h * scale_y)
 
 # Mapping Function
-def find_local_mapping_and_transform(placeholders, uied_boxes, uied_shape, W_orig, H_orig):
+def fit_scale_translation_ransac(src, dst, groups, tolerances, prior_scale, max_hypotheses=RANSAC_HYPOTHESES, seed=0):
+    """
+    Fits the axis-aligned model dst = scale * src + translation with two-point RANSAC,
+    scoring all hypotheses against all correspondences at once.
+    `src`, `dst` (k, 2): putative center correspondences; `groups` (k,): sorted placeholder index of
+    each correspondence (a placeholder counts once as an inlier); `tolerances` (k,): inlier residuals.
+    :return: ((scale_x, scale_y, dx, dy), report), or (None, report) when no model has
+             RANSAC_MIN_INLIERS inlier placeholders
+    """
+    src, dst = np.asarray(src, dtype=float), np.asarray(dst, dtype=float)
+    prior = np.asarray(prior_scale, dtype=float)
+    report = {"method": "ransac", "correspondences": int(len(src)), "hypotheses": 0, "inliers": 0, "residual": None}
+
+    # 1. Hypotheses from pairs of correspondences of different placeholders
+    k = len(src)
+    if k * (k - 1) // 2 <= max_hypotheses:
+        i, j = np.triu_indices(k, 1)
+    else:
+        i, j = np.random.default_rng(seed).integers(0, k, (2, max_hypotheses * 2))
+    distinct = groups[i] != groups[j]
+    i, j = i[distinct][:max_hypotheses], j[distinct][:max_hypotheses]
+    report["hypotheses"] = int(len(i))
+    if not len(i):
+        return None, report
+
+    du, dv = src[j] - src[i], dst[j] - dst[i]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # an axis along which the two sources coincide keeps the image-shape scale
+        scale = np.where(np.abs(du) >= 1, dv / du, prior)
+    translation = dst[i] - scale * src[i]
+    plausible = ((scale >= prior * RANSAC_SCALE_RANGE[0]) & (scale <= prior * RANSAC_SCALE_RANGE[1])).all(axis=1)
+
+    # 2. Score every hypothesis: placeholders with at least one inlier correspondence
+    residuals = np.hypot(*np.moveaxis(scale[:, None, :] * src[None] + translation[:, None, :] - dst[None], -1, 0))
+    inliers = residuals <= tolerances[None]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    scores = np.logical_or.reduceat(inliers, starts, axis=1).sum(axis=1)
+    scores = np.where(plausible, scores, -1)
+    # ties go to the hypothesis with the smaller total inlier residual
+    best = np.lexsort((np.where(inliers, residuals, 0).sum(axis=1), -scores))[0]
+    report["inliers"] = int(max(scores[best], 0))
+    if scores[best] < RANSAC_MIN_INLIERS:
+        return None, report
+
+    # 3. Refit on the best inlier correspondence of every inlier placeholder (least squares per axis)
+    candidates = np.flatnonzero(inliers[best])
+    order = candidates[np.lexsort((residuals[best, candidates], groups[candidates]))]
+    chosen = order[np.r_[True, groups[order][1:] != groups[order][:-1]]]
+    model = []
+    for axis in range(2):
+        x, y = src[chosen, axis], dst[chosen, axis]
+        s_axis = np.polyfit(x, y, 1)[0] if np.ptp(x) >= 1 else scale[best, axis]
+        if not prior[axis] * RANSAC_SCALE_RANGE[0] <= s_axis <= prior[axis] * RANSAC_SCALE_RANGE[1]:
+            s_axis = scale[best, axis]
+        model.append((s_axis, float(np.mean(y - s_axis * x))))
+    (sx, dx), (sy, dy) = model
+    fitted = src[chosen] * [sx, sy] + [dx, dy]
+    report["residual"] = float(np.sqrt(np.mean(np.sum((fitted - dst[chosen]) ** 2, axis=1))))
+    return (float(sx), float(sy), dx, dy), report
+
+def find_local_mapping_and_transform(placeholders, uied_boxes, uied_shape, W_orig, H_orig, prior_translation=(0, 0)):
     """
     Finds the optimal one-to-one mapping and the local affine transform for a given
-    subset of placeholders and UIED boxes.
+    subset of placeholders and UIED boxes. `prior_translation` is the global (dx, dy).
+    Also returns a report of the transform fit and of how the assignment was solved.
     """
     if not placeholders or not uied_boxes:
-        return {}, (1, 1, 0, 0)
+        return {}, (1, 1, 0, 0), None
     
-    # 1. Estimate local affine transform
-    # 1a. Calculate base scaling from image dimension ratios
+    # 1. Estimate local transform
+    # 1a. Base scaling from image dimension ratios, the prior of the fit
     H_proc, W_proc, _ = uied_shape
     scale_x = W_orig / W_proc
     scale_y = H_orig / H_proc
 
-    # 1b. Apply this scaling to UIED boxes
-    uied_scaled = [{**u, "bbox": (u["bbox"][0]*scale_x, u["bbox"][1]*scale_y, u["bbox"][2]*scale_x, u["bbox"][3]*scale_y)} for u in uied_boxes]
-
-    # 1c. Estimate residual translation (dx, dy) by matching centers
-    ph_centers = np.array([center(p["bbox"]) for p in placeholders])
-    uied_scaled_centers = np.array([center(u["bbox"]) for u in uied_scaled])
-    
-    indices = cdist(ph_centers, uied_scaled_centers).argmin(axis=1)
-    translations = ph_centers - uied_scaled_centers[indices]
-    dx, dy = np.median(translations, axis=0)
-
-    transform = (scale_x, scale_y, dx, dy)
+    # 1b. Putative correspondences: the nearest UIED centers of each placeholder under the prior
+    ph_boxes = np.array([p["bbox"] for p in placeholders], dtype=float)
+    ph_centers = ph_boxes[:, :2] + ph_boxes[:, 2:] / 2
+    uied_proc = np.array([u["bbox"] for u in uied_boxes], dtype=float)
+    uied_centers = uied_proc[:, :2] + uied_proc[:, 2:] / 2
+    k = min(RANSAC_NEIGHBORS, len(uied_boxes))
+    nearest = np.argsort(cdist(ph_centers, uied_centers * [scale_x, scale_y] + prior_translation), axis=1)[:, :k]
+    tolerances = np.maximum(RANSAC_MIN_INLIER_PX, RANSAC_INLIER_RATIO * ph_boxes[:, 2:].min(axis=1))
+
+    # 1c. Scale and translation per axis with RANSAC; the median offset to the nearest
+    # centers at the image-shape scale is kept when too few placeholders agree on a model
+    transform, fit = fit_scale_translation_ransac(
+        uied_centers[nearest].reshape(-1, 2), np.repeat(ph_centers, k, axis=0),
+        np.repeat(np.arange(len(placeholders)), k), np.repeat(tolerances, k), (scale_x, scale_y)
+    )
+    if transform is None:
+        translations = ph_centers - uied_centers[nearest[:, 0]] * [scale_x, scale_y]
+        dx, dy = np.median(translations, axis=0)
+        transform = (scale_x, scale_y, float(dx), float(dy))
+        fit["method"] = "median"
+    scale_x, scale_y, dx, dy = transform
     
     # 2. Apply the final, full transformation to all UIED boxes in this subset
     uied_tf = [{**u, "bbox_tf": apply_affine_transform(u["bbox"], scale_x, scale_y, dx, dy)} for u in uied_boxes]
     
-    # 3. Create a cost matrix and find optimal assignment
-    num_gray = len(placeholders)
-    num_uied = len(uied_tf)
-    cost_matrix = np.zeros((num_gray, num_uied))
+    # 3. Match over gated candidate pairs, solving each connected component on its own
+    matches, assignment = gated_assignment([p["bbox"] for p in placeholders], [u["bbox_tf"] for u in uied_tf])
 
-    for i in range(num_gray):
-        for j in range(num_uied):
-            cost_matrix[i, j] = -ciou(placeholders[i]["bbox"], uied_tf[j]["bbox_tf"])
+    # 4. Create the one-to-one mapping
+    mapping = {placeholders[r]["id"]: uied_tf[c]["id"] for r, c, _ in matches}
+    return mapping, transform, {"fit": fit, "assignment": assignment}
 
-    row_ind, col_ind = linear_sum_assignment(cost_matrix)
 
-    # 4. Create the one-to-one mapping
-    mapping = {}
-    for r, c in zip(row_ind, col_ind):
-        score = -cost_matrix[r, c]
-        if score >= CIOU_STRICT:
-            g_id = placeholders[r]["id"]
-            u_id = uied_tf[c]["id"]
-            mapping[g_id] = u_id
-            
-    return mapping, transform
+def gated_assignment(a_boxes, b_boxes, min_score=CIOU_STRICT, gate=MATCH_GATE, dense_max_cells=DENSE_MAX_CELLS,
+                      exact_max_cells=EXACT_MAX_CELLS):
+    """
+    One-to-one matching of boxes maximizing CIoU over gated candidate pairs only.
+    Pairs are candidates when they overlap or their centers are within `gate` mean diagonals,
+    and their CIoU reaches `min_score`. Up to `dense_max_cells` pairs, the full CIoU matrix is
+    solved with one `linear_sum_assignment`. Larger problems split the candidate graph into
+    connected components; each is solved exactly unless its cost matrix exceeds
+    `exact_max_cells`, in which case a greedy max-score matching is used (not optimal).
+    :return: ([(i, j, score)], info) where info reports the mode ("dense", "exact", "greedy", "mixed") and graph sizes
+    """
+    a = np.asarray(a_boxes, dtype=float).reshape(-1, 4)
+    b = np.asarray(b_boxes, dtype=float).reshape(-1, 4)
+    info = {"mode": "exact", "candidates": 0, "components": 0, "largest_component": [0, 0]}
+    if not len(a) or not len(b):
+        return [], info
+    ca, cb = a[:, :2] + a[:, 2:] / 2, b[:, :2] + b[:, 2:] / 2
+    diag_a, diag_b = np.hypot(a[:, 2], a[:, 3]), np.hypot(b[:, 2], b[:, 3])
+
+    # Small regions: one dense matrix is cheaper than building the candidate graph
+    if len(a) * len(b) <= dense_max_cells:
+        offset = np.abs(cb[None] - ca[:, None])
+        overlaps = (offset < (a[:, None, 2:] + b[None, :, 2:]) / 2).all(axis=2)
+        near = np.hypot(offset[..., 0], offset[..., 1]) <= gate * (diag_a[:, None] + diag_b[None]) / 2
+        scores = ciou_matrix(a, b).astype(float)
+        candidate = (overlaps | near) & (scores >= min_score)
+        non_candidate = 2.0 + candidate.sum()  # worse than any set of candidate pairs
+        matches = [(int(r), int(c), float(scores[r, c]))
+                   for r, c in zip(*linear_sum_assignment(np.where(candidate, -scores, non_candidate)))
+                   if candidate[r, c]]
+        info.update(mode="dense", candidates=int(candidate.sum()), components=1, largest_component=[len(a), len(b)])
+        return sorted(matches), info
+
+    # 1. Candidate pairs from a grid query around each box center
+    index = GridIndex(cb)
+    rows, cols = [], []
+    for i in range(len(a)):
+        # overlapping boxes have centers within their mean diagonal
+        reach = max(gate, 1.0) * (diag_a[i] + diag_b.max()) / 2
+        idx = index.query_rect(ca[i, 0] - reach, ca[i, 1] - reach, 2 * reach, 2 * reach)
+        offset = np.abs(cb[idx] - ca[i])
+        overlaps = (offset < (a[i, 2:] + b[idx, 2:]) / 2).all(axis=1)
+        idx = idx[overlaps | (np.hypot(offset[:, 0], offset[:, 1]) <= gate * (diag_a[i] + diag_b[idx]) / 2)]
+        rows.append(np.full(len(idx), i))
+        cols.append(idx)
+    rows, cols = np.concatenate(rows).astype(int), np.concatenate(cols).astype(int)
+    scores = ciou_pairs(a[rows], b[cols]).astype(float)
+    keep = scores >= min_score
+    rows, cols, scores = rows[keep], cols[keep], scores[keep]
+    info["candidates"] = int(len(rows))
+    if not len(rows):
+        return [], info
+
+    # 2. Connected components of the bipartite candidate graph (b nodes are offset by len(a))
+    n_nodes = len(a) + len(b)
+    graph = coo_matrix((np.ones(len(rows)), (rows, cols + len(a))), shape=(n_nodes, n_nodes))
+    _, labels = connected_components(graph, directed=False)
+    pair_labels = labels[rows]
+    order = np.argsort(pair_labels, kind='stable')
+    _, starts = np.unique(pair_labels[order], return_index=True)
+
+    # 3. Solve every component on its own
+    matches, modes = [], set()
+    for group in np.split(order, starts[1:]):
+        r_ids, r_inv = np.unique(rows[group], return_inverse=True)
+        c_ids, c_inv = np.unique(cols[group], return_inverse=True)
+        if len(r_ids) * len(c_ids) > info["largest_component"][0] * info["largest_component"][1]:
+            info["largest_component"] = [int(len(r_ids)), int(len(c_ids))]
+        if len(r_ids) * len(c_ids) <= exact_max_cells:
+            modes.add("exact")
+            non_candidate = 2.0 + len(group)  # worse than any set of candidate pairs
+            cost = np.full((len(r_ids), len(c_ids)), non_candidate)
+            cost[r_inv, c_inv] = -scores[group]
+            for r, c in zip(*linear_sum_assignment(cost)):
+                if cost[r, c] < non_candidate:
+                    matches.append((int(r_ids[r]), int(c_ids[c]), -float(cost[r, c])))
+        else:
+            modes.add("greedy")
+            used_r, used_c = set(), set()
+            for k in group[np.argsort(-scores[group], kind='stable')]:
+                if rows[k] not in used_r and cols[k] not in used_c:
+                    used_r.add(rows[k])
+                    used_c.add(cols[k])
+                    matches.append((int(rows[k]), int(cols[k]), float(scores[k])))
+    info["components"] = len(starts)
+    info["mode"] = modes.pop() if len(modes) == 1 else "mixed"
+    return sorted(matches), info
 
 
 def generate_debug_overlay(img_path, all_uied_boxes, region_results, uied_shape, out_png):
@@ -267,12 +537,13 @@ def main():
         print("Error: Could not proceed without placeholder and UIED data.")
         return
 
-    # 4. Estimate a GLOBAL transform for rough, initial alignment of all UIED boxes
-    g_scale_x, g_scale_y, g_dx, g_dy = estimate_global_transform(pixel_placeholders, all_uied_boxes, uied_shape, W_orig, H_orig)
+    # 4. Estimate a GLOBAL transform for rough, initial alignment of all UIED boxes.
+    # The index over scaled UIED centers is built once and serves all lookups of this run.
+    uied_index = build_uied_index(all_uied_boxes, uied_shape, W_orig, H_orig)
+    g_scale_x, g_scale_y, g_dx, g_dy = estimate_global_transform(
+        pixel_placeholders, all_uied_boxes, uied_shape, W_orig, H_orig, index=uied_index
+    )
     print(f"Estimated Global Transform: scale_x={g_scale_x:.3f}, scale_y={g_scale_y:.3f}, dx={g_dx:.1f}, dy={g_dy:.1f}")
-    
-    # Apply the global transform to all UIED boxes to get them into the main coordinate space
-    uied_tf_global = [{**u, "bbox_tf": apply_affine_transform(u["bbox"], g_scale_x, g_scale_y, g_dx, g_dy)} for u in all_uied_boxes]
 
     # 5. Loop through regions and perform LOCALIZED matching and transform estimation
     final_results = {}
@@ -285,30 +556,34 @@ def main():
         if not region_placeholders:
             continue
 
-        # Filter UIED boxes for the current region using the globally transformed coordinates
+        # Filter UIED boxes whose globally transformed center lies in the region; the index
+        # holds untranslated centers, so the region is shifted back by the global translation
         rx, ry, rw, rh = region["bbox"]
-        region_uied_ids = {
-            u['id'] for u in uied_tf_global 
-            if rx <= center(u["bbox_tf"])[0] <= rx + rw and ry <= center(u["bbox_tf"])[1] <= ry + rh
-        }
-        # Get the original uied boxes that correspond to this region
-        region_uied_boxes = [u for u in all_uied_boxes if u['id'] in region_uied_ids]
+        region_uied_boxes = [all_uied_boxes[i] for i in uied_index.query_rect(rx - g_dx, ry - g_dy, rw, rh)]
         
         if not region_uied_boxes:
             print(f"Warning: No UIED boxes found in region {region['id']} after global alignment.")
             continue
 
         # Find the precise LOCAL mapping and transform for this region
-        region_mapping, region_transform = find_local_mapping_and_transform(
-            region_placeholders, region_uied_boxes, uied_shape, W_orig, H_orig
+        region_mapping, region_transform, report = find_local_mapping_and_transform(
+            region_placeholders, region_uied_boxes, uied_shape, W_orig, H_orig, prior_translation=(g_dx, g_dy)
         )
+        if report is not None:
+            fit, assignment = report["fit"], report["assignment"]
+            residual = f", residual {fit['residual']:.1f}px" if fit["residual"] is not None else ""
+            print(f"Region {region['id']}: {fit['method']} transform fit with {fit['inliers']}/{len(region_placeholders)} "
+                  f"inlier placeholders{residual}; {assignment['mode']} assignment over {assignment['candidates']} "
+                  f"candidate pairs in {assignment['components']} component(s), largest {assignment['largest_component']}")
         
         if region_mapping:
             total_mappings_count += len(region_mapping)
             l_scale_x, l_scale_y, l_dx, l_dy = region_transform
             final_results[region["id"]] = {
                 "transform": { "scale_x": l_scale_x, "scale_y": l_scale_y, "dx": l_dx, "dy": l_dy },
-                "mapping": region_mapping
+                "mapping": region_mapping,
+                "fit": report["fit"],
+                "assignment": report["assignment"]
             }
 
     # 6. Report and save results
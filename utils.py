@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 from openai import OpenAI
 from volcenginesdkarkruntime import Ark
@@ -8,6 +9,12 @@ from PIL import Image, ImageDraw
 import cv2
 import numpy as np
 
+# Share UIED's pre-processing (gradient map) with the layout-level tools.
+UIED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "UIED")
+if UIED_DIR not in sys.path:
+    sys.path.append(UIED_DIR)
+from detect_compo.lib_ip.ip_preprocessing import gray_to_gradient
+
 
 def encode_image(image):
     if type(image) == str:
@@ -211,6 +218,109 @@ def visualize_projection_analysis(image_path: str, analysis_result: dict,
         print("Error: Failed to save visualization")
         return ""
 
+def downscale_image(image_path: str, max_side: int) -> Image.Image:
+    """Loads an image and shrinks it so that its longest side is at most `max_side` pixels."""
+    image = Image.open(image_path)
+    image.load()
+    w, h = image.size
+    scale = max_side / max(w, h)
+    if scale >= 1:
+        return image
+    return image.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+
+def split_by_gutters(active: np.ndarray, axis: int, min_gap: int, min_length: int) -> list[tuple[int, int]]:
+    """
+    Splits a boolean activity map (e.g. gradient > threshold) along `axis` at whitespace gutters.
+    axis=0 cuts between rows, axis=1 between columns. A gutter is a run of at least `min_gap`
+    inactive lines. Returns the [start, end) spans of the content between gutters; spans shorter
+    than `min_length` are merged into their neighbour.
+    """
+    blank = ~active.any(axis=1 - axis)
+    if blank.all():
+        return []
+    # run boundaries of the blank profile
+    padded = np.concatenate(([False], blank, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    gutters = [(s, e) for s, e in zip(changes[::2], changes[1::2]) if e - s >= min_gap]
+
+    content = np.flatnonzero(~blank)
+    spans, start = [], content[0]
+    for g_start, g_end in gutters:
+        if start < g_start:
+            spans.append((start, g_start))
+        start = max(start, g_end)
+    if start <= content[-1]:
+        spans.append((start, content[-1] + 1))
+
+    merged = []
+    for span in spans:
+        if merged and (merged[-1][1] - merged[-1][0] < min_length or span[1] - span[0] < min_length):
+            merged[-1] = (merged[-1][0], span[1])
+        else:
+            merged.append(span)
+    return [(int(s), int(e)) for s, e in merged]
+
+def perceptual_hash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash (dHash) of an image: compares neighbouring pixels of a tiny grey thumbnail."""
+    thumb = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+    return bin(hash_a ^ hash_b).count("1")
+
+def _snap_position(profile: np.ndarray, offset: int, coarse: int, side: str,
+                   edge_ratio: float, blank_ratio: float) -> int:
+    """
+    Picks the candidate position in a 1-D gradient profile closest to the coarse edge.
+    Candidates are strong lines (borders) and the content side of whitespace gutters.
+    """
+    candidates = list(np.where(profile >= edge_ratio)[0])
+    blank = profile <= blank_ratio
+    if side == 'start':
+        # first content line after a gutter
+        candidates += list(np.where(blank[:-1] & ~blank[1:])[0] + 1)
+    else:
+        # last content line before a gutter
+        candidates += list(np.where(~blank[:-1] & blank[1:])[0])
+    if not candidates:
+        return coarse
+    candidates = np.array(candidates) + offset
+    return int(candidates[np.argmin(np.abs(candidates - coarse))])
+
+def snap_bbox_to_edges(gradient: np.ndarray, bbox_pixels: tuple[int, int, int, int], radius: int,
+                       grad_min: int = 10, edge_ratio: float = 0.5, blank_ratio: float = 0.01) -> tuple[int, int, int, int]:
+    """
+    Refines a coarse pixel bbox by moving each edge, within `radius` pixels, to the nearest
+    strong gradient line or whitespace gutter boundary of the full-resolution gradient map.
+    """
+    h, w = gradient.shape[:2]
+    x1, y1, x2, y2 = bbox_pixels
+    x1, x2 = max(0, min(x1, w - 1)), max(0, min(x2, w - 1))
+    y1, y2 = max(0, min(y1, h - 1)), max(0, min(y2, h - 1))
+    if x2 <= x1 or y2 <= y1:
+        return bbox_pixels
+    active = gradient > grad_min
+    # never move an edge inwards by more than a quarter of the box, so boxes cannot collapse
+    inward_x = max(1, min(radius, (x2 - x1) // 4))
+    inward_y = max(1, min(radius, (y2 - y1) // 4))
+
+    def column_profile(lo, hi):
+        lo, hi = max(0, lo), min(w, hi + 1)
+        return active[y1:y2 + 1, lo:hi].mean(axis=0), lo
+
+    def row_profile(lo, hi):
+        lo, hi = max(0, lo), min(h, hi + 1)
+        return active[lo:hi, x1:x2 + 1].mean(axis=1), lo
+
+    new_x1 = _snap_position(*column_profile(x1 - radius, x1 + inward_x), x1, 'start', edge_ratio, blank_ratio)
+    new_x2 = _snap_position(*column_profile(x2 - inward_x, x2 + radius), x2, 'end', edge_ratio, blank_ratio)
+    new_y1 = _snap_position(*row_profile(y1 - radius, y1 + inward_y), y1, 'start', edge_ratio, blank_ratio)
+    new_y2 = _snap_position(*row_profile(y2 - inward_y, y2 + radius), y2, 'end', edge_ratio, blank_ratio)
+    if new_x2 <= new_x1 or new_y2 <= new_y1:
+        return bbox_pixels
+    return new_x1, new_y1, new_x2, new_y2
+
 
 
 class Bot: